@@ -4,6 +4,7 @@ from pyrogram import Client, __version__
 from pyrogram.raw.all import layer
 from database.database import db
 from config import Config
+from utils import load_title_index, admission, flood_sleep_threshold
 
 # Configure logging
 logging.basicConfig(
@@ -25,6 +26,13 @@ class Bot(Client):
             sleep_threshold=60,
         )
 
+    async def invoke(self, query, *args, **kwargs):
+        """Invoke an API call; calls from the outbound queue sleep out only short FloodWaits"""
+        threshold = flood_sleep_threshold.get()
+        if threshold is not None and kwargs.get('sleep_threshold') is None:
+            kwargs['sleep_threshold'] = threshold
+        return await super().invoke(query, *args, **kwargs)
+
     async def start(self):
         """Start the bot"""
         await super().start()
@@ -32,6 +40,13 @@ class Bot(Client):
         # Initialize database connections
         await db.initialize()
         
+        # Share search admission budgets with other bot processes
+        if Config.ADMISSION_SHARED and db.redis_client:
+            admission.redis_client = db.redis_client
+        
+        # Open the offline IMDb index if one has been built
+        load_title_index()
+        
         # Get bot info
         me = await self.get_me()
         
@@ -64,6 +79,17 @@ class Bot(Client):
         """Stop the bot"""
         logger.info("🛑 Bot stopping...")
         
+        # Stop the shard health monitor, any startup warm-up and the
+        # cache invalidation listener
+        for task in (db.reconnect_task, db.warm_task, db.invalidation_task):
+            if task:
+                task.cancel()
+        
+        # Keep the vocabulary filter for a fast next start; a partial one
+        # from an interrupted warm-up would hide stored files, so skip it
+        if db.vocabulary_ready:
+            await db.save_vocabulary()
+        
         # Close database connections
         for client in db.clients:
             try:
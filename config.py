@@ -22,20 +22,84 @@ class Config:
     # Performance Settings
     MAX_RESULTS = int(os.environ.get("MAX_RESULTS", "50"))
     CACHE_TIME = int(os.environ.get("CACHE_TIME", "300"))  # 5 minutes
+    SEARCH_CACHE_MB = int(os.environ.get("SEARCH_CACHE_MB", "64"))  # local search and facet results
+    DETAIL_CACHE_MB = int(os.environ.get("DETAIL_CACHE_MB", "16"))  # local file documents
+    DETAIL_CACHE_TIME = int(os.environ.get("DETAIL_CACHE_TIME", "86400"))  # file documents in Redis, 1 day
+    SHARD_TIMEOUT = float(os.environ.get("SHARD_TIMEOUT", "2.0"))  # seconds per shard
+    MEMORY_INDEX = os.environ.get("MEMORY_INDEX", "True").lower() == "true"
+    RANK_K1 = float(os.environ.get("RANK_K1", "1.2"))
+    RANK_B = float(os.environ.get("RANK_B", "0.75"))
+    RECENCY_BOOST = float(os.environ.get("RECENCY_BOOST", "0.2"))  # up to +20% for brand new files
+    RECENCY_HALF_LIFE = float(os.environ.get("RECENCY_HALF_LIFE", "30"))  # days
+    PREFERRED_QUALITY = os.environ.get("PREFERRED_QUALITY", "1080p")
+    QUALITY_BOOST = float(os.environ.get("QUALITY_BOOST", "0.1"))
+    BLOOM_PATH = os.environ.get("BLOOM_PATH", "vocabulary.bloom")
+    BLOOM_CAPACITY = int(os.environ.get("BLOOM_CAPACITY", "2000000"))  # distinct words and prefixes
+    BLOOM_ERROR_RATE = float(os.environ.get("BLOOM_ERROR_RATE", "0.01"))
+    INLINE_RESULTS = int(os.environ.get("INLINE_RESULTS", "20"))  # per page, Telegram allows 50
+    INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "300"))  # seconds
     MAX_LIST_ELM = int(os.environ.get("MAX_LIST_ELM", "4"))
+    SESSION_TIME = int(os.environ.get("SESSION_TIME", "3600"))  # 1 hour
+    MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", "5000"))
+    
+    # Shard Health Settings
+    SHARD_ERROR_THRESHOLD = float(os.environ.get("SHARD_ERROR_THRESHOLD", "0.5"))
+    SHARD_SLOW_MS = float(os.environ.get("SHARD_SLOW_MS", "1500"))
+    SHARD_COOLDOWN = int(os.environ.get("SHARD_COOLDOWN", "30"))  # seconds
+    SHARD_RETRY_INTERVAL = int(os.environ.get("SHARD_RETRY_INTERVAL", "60"))  # seconds
     
     # Channel/Group Settings
     CHANNELS = [int(ch) if ch.startswith("-") else ch for ch in os.environ.get("CHANNELS", "").split()]
     AUTH_USERS = [int(user) for user in os.environ.get("AUTH_USERS", "").split()]
     AUTH_CHANNEL = int(os.environ.get("AUTH_CHANNEL", "0"))
+    MEMBERSHIP_CACHE_SIZE = int(os.environ.get("MEMBERSHIP_CACHE_SIZE", "50000"))
+    MEMBERSHIP_CACHE_TIME = int(os.environ.get("MEMBERSHIP_CACHE_TIME", "3600"))  # 1 hour
+    MEMBERSHIP_NEGATIVE_CACHE_TIME = int(os.environ.get("MEMBERSHIP_NEGATIVE_CACHE_TIME", "300"))  # 5 minutes
+    
+    # Search Admission Control (searches per second and burst size)
+    ADMISSION_USER_RATE = float(os.environ.get("ADMISSION_USER_RATE", "0.5"))
+    ADMISSION_USER_BURST = float(os.environ.get("ADMISSION_USER_BURST", "3"))
+    # Per group; keep at or below SEND_GROUP_RATE/SEND_BURST, or admitted searches queue up unanswered
+    ADMISSION_CHAT_RATE = float(os.environ.get("ADMISSION_CHAT_RATE", "0.33"))
+    ADMISSION_CHAT_BURST = float(os.environ.get("ADMISSION_CHAT_BURST", "3"))
+    ADMISSION_GLOBAL_RATE = float(os.environ.get("ADMISSION_GLOBAL_RATE", "30"))
+    ADMISSION_GLOBAL_BURST = float(os.environ.get("ADMISSION_GLOBAL_BURST", "60"))
+    ADMISSION_SHED_RESERVE = float(os.environ.get("ADMISSION_SHED_RESERVE", "0.25"))  # share kept for high priority
+    ADMISSION_SHARED = os.environ.get("ADMISSION_SHARED", "False").lower() == "true"  # share budgets through Redis
+    
+    # Outbound Message Pacing (messages per second, Telegram allows ~30 overall)
+    SEND_GLOBAL_RATE = float(os.environ.get("SEND_GLOBAL_RATE", "25"))
+    SEND_PRIVATE_RATE = float(os.environ.get("SEND_PRIVATE_RATE", "1"))
+    SEND_GROUP_RATE = float(os.environ.get("SEND_GROUP_RATE", "0.33"))  # 20 per minute
+    SEND_BURST = float(os.environ.get("SEND_BURST", "3"))
+    SEND_CONCURRENCY = int(os.environ.get("SEND_CONCURRENCY", "8"))
+    SEND_RETRIES = int(os.environ.get("SEND_RETRIES", "3"))
+    # Queued calls raise longer FloodWaits to the outbound queue instead of sleeping them out
+    FLOOD_SLEEP_THRESHOLD = int(os.environ.get("FLOOD_SLEEP_THRESHOLD", "5"))  # seconds
+    SEND_CHAT_BACKLOG = int(os.environ.get("SEND_CHAT_BACKLOG", "3"))  # queued search replies per chat, 0 keeps all
+    SEND_ALL_PER_USER = int(os.environ.get("SEND_ALL_PER_USER", "1"))  # concurrent "Send all" deliveries
     
     # IMDB Settings
     IMDB = bool(os.environ.get("IMDB", True))
     SPELL_CHECK = bool(os.environ.get("SPELL_CHECK", True))
+    SPELL_MAX_WORDS = int(os.environ.get("SPELL_MAX_WORDS", "100000"))
+    SPELL_MAX_MB = int(os.environ.get("SPELL_MAX_MB", "128"))
+    IMDB_WORKERS = int(os.environ.get("IMDB_WORKERS", "4"))
+    IMDB_TIMEOUT = float(os.environ.get("IMDB_TIMEOUT", "1.5"))  # seconds
+    IMDB_CACHE_SIZE = int(os.environ.get("IMDB_CACHE_SIZE", "5000"))
+    IMDB_CACHE_TIME = int(os.environ.get("IMDB_CACHE_TIME", "604800"))  # 7 days
+    IMDB_NEGATIVE_CACHE_TIME = int(os.environ.get("IMDB_NEGATIVE_CACHE_TIME", "21600"))  # 6 hours
+    
+    # Offline IMDb index built from https://datasets.imdbws.com dumps (empty disables)
+    IMDB_INDEX_PATH = os.environ.get("IMDB_INDEX_PATH", "")
+    IMDB_DUMP_URL = os.environ.get("IMDB_DUMP_URL", "https://datasets.imdbws.com")
+    IMDB_MIN_VOTES = int(os.environ.get("IMDB_MIN_VOTES", "50"))
     
     # Performance Optimization
     WORKERS = int(os.environ.get("WORKERS", "8"))
     BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "100"))
+    INDEX_WORKERS = int(os.environ.get("INDEX_WORKERS", "4"))
+    INDEX_QUEUE_SIZE = int(os.environ.get("INDEX_QUEUE_SIZE", "1000"))
     
     # Connection Pool Settings
     MAX_POOL_SIZE = int(os.environ.get("MAX_POOL_SIZE", "50"))
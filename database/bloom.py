@@ -0,0 +1,80 @@
+import hashlib
+import math
+import os
+import struct
+from typing import Dict, Optional
+
+MAGIC = b"BLOOM001"
+HEADER = struct.Struct("<8sQIQ")        # magic, bit count, hash count, item count
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter of strings with double hashing"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=16).digest(), "little")
+        h1, h2 = digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1
+        for _ in range(self.hashes):
+            yield h1 % self.size
+            h1 += h2
+
+    def add(self, item: str):
+        bits = self.bits
+        new = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                new = True
+        # Items whose bits were all set already are taken as seen before
+        if new:
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def false_positive_rate(self) -> float:
+        """Expected false positive rate at the current fill"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def save(self, path: str):
+        """Write the filter atomically, so a crash never leaves a torn file"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.size, self.hashes, self.count))
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, capacity: int, error_rate: float) -> Optional["BloomFilter"]:
+        """Read a saved filter, or None if missing or built with other settings"""
+        bloom = cls(capacity, error_rate)
+        try:
+            with open(path, "rb") as f:
+                magic, size, hashes, count = HEADER.unpack(f.read(HEADER.size))
+                if magic != MAGIC or size != bloom.size or hashes != bloom.hashes:
+                    return None
+                bits = f.read()
+        except (OSError, struct.error):
+            return None
+        if len(bits) != len(bloom.bits):
+            return None
+        bloom.bits = bytearray(bits)
+        bloom.count = count
+        return bloom
+
+    def stats(self) -> Dict:
+        return {
+            'items': self.count,
+            'bytes': len(self.bits),
+            'false_positive_rate': round(self.false_positive_rate(), 4)
+        }
@@ -0,0 +1,142 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+_MISSING = object()
+
+
+def estimate_size(value) -> int:
+    """Approximate bytes held by a cached value and everything it contains"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + estimate_size(item)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += estimate_size(item)
+    return size
+
+
+class SegmentedLRUCache:
+    """Byte-budgeted segmented LRU cache with a TTL
+
+    New entries start in a probation segment and move to the protected
+    segment on their second hit. Eviction takes the least recently used
+    probation entries first, so a burst of one-off queries cannot push
+    out entries that are read again and again.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, protected_ratio: float = 0.8):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.protected_bytes_limit = int(max_bytes * protected_ratio)
+
+        # key -> (value, size, expires_at)
+        self.probation: OrderedDict = OrderedDict()
+        self.protected: OrderedDict = OrderedDict()
+        self.probation_bytes = 0
+        self.protected_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    def __len__(self):
+        return len(self.probation) + len(self.protected)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self.probation.get(key) or self.protected.get(key)
+        return entry is not None and entry[2] > time.monotonic()
+
+    @property
+    def bytes(self) -> int:
+        return self.probation_bytes + self.protected_bytes
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+
+        entry = self.protected.get(key)
+        if entry is not None:
+            if entry[2] <= now:
+                self._remove(key)
+                self.misses += 1
+                return default
+            self.protected.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        entry = self.probation.pop(key, None)
+        if entry is None or entry[2] <= now:
+            if entry is not None:
+                self.probation_bytes -= entry[1]
+            self.misses += 1
+            return default
+
+        # Second hit: promote, demoting protected entries over its share
+        self.probation_bytes -= entry[1]
+        self.protected[key] = entry
+        self.protected_bytes += entry[1]
+        while self.protected_bytes > self.protected_bytes_limit and len(self.protected) > 1:
+            old_key, old_entry = self.protected.popitem(last=False)
+            self.protected_bytes -= old_entry[1]
+            self.probation[old_key] = old_entry
+            self.probation_bytes += old_entry[1]
+
+        self.hits += 1
+        return entry[0]
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self._remove(key)
+
+        size = estimate_size(value)
+        if size > self.max_bytes // 4:
+            # One oversized entry would flush most of the cache
+            self.rejections += 1
+            return
+
+        self.probation[key] = (value, size, time.monotonic() + self.ttl)
+        self.probation_bytes += size
+
+        while self.bytes > self.max_bytes:
+            segment = self.probation if self.probation else self.protected
+            _, old_entry = segment.popitem(last=False)
+            if segment is self.probation:
+                self.probation_bytes -= old_entry[1]
+            else:
+                self.protected_bytes -= old_entry[1]
+            self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        entry = self.probation.pop(key, None)
+        if entry is not None:
+            self.probation_bytes -= entry[1]
+            return entry
+        entry = self.protected.pop(key, None)
+        if entry is not None:
+            self.protected_bytes -= entry[1]
+        return entry
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._remove(key)
+        return default if entry is None else entry[0]
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'evictions': self.evictions,
+            'rejections': self.rejections
+        }
@@ -1,14 +1,29 @@
 import asyncio
+import heapq
+import uuid
 import motor.motor_asyncio
-from pymongo.errors import DuplicateKeyError
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
 from umongo import Instance, Document, fields
 from motor.motor_asyncio import AsyncIOMotorClient
 from marshmallow.exceptions import ValidationError
 from config import Config
+from database.sharding import HashRing
+from database.normalize import tokenize, edge_ngrams, cache_tokens, invalidation_tokens, normalize_query, MATCH_ALL_TOKEN
+from database.singleflight import SingleFlight
+from database.health import ShardHealth, CLOSED
+from database.spelling import SymSpell
+from database.search_index import SearchIndex
+from database.bloom import BloomFilter
+from database.ranking import BM25Ranker
+from database.cache import SegmentedLRUCache
+from database.serialization import RESULT_FIELDS, pack_results, unpack_results, pack_document, unpack_document
+from database.serialization import pack_message, unpack_message, index_rows, index_documents
+from utils import clean_filename, extract_year
 import logging
-from typing import List, Dict, Optional
+import re
+from typing import List, Dict, Optional, Set, Iterable, Tuple, Union
 import time
-from cachetools import TTLCache
 import redis.asyncio as redis
 
 logger = logging.getLogger(__name__)
@@ -18,9 +33,41 @@ class DatabaseManager:
         self.clients = []
         self.databases = []
         self.collections = []
+        self.shards = {}  # shard id (DATABASE_URI_n slot) -> collection
+        self.health: Dict[int, ShardHealth] = {}
+        self.pending_uris: Dict[int, str] = {}  # shards waiting for a reconnect
+        self.reconnect_task = None
+        self.ring = HashRing()
         self.current_db = 0
-        self.cache = TTLCache(maxsize=1000, ttl=Config.CACHE_TIME)
+        # Separate byte budgets, so detail lookups cannot evict hot searches
+        self.cache = SegmentedLRUCache(Config.SEARCH_CACHE_MB << 20, Config.CACHE_TIME)
+        self.detail_cache = SegmentedLRUCache(Config.DETAIL_CACHE_MB << 20, Config.CACHE_TIME)
+        self.prefetch_tasks: Set[asyncio.Task] = set()
+        self.search_tokens: Dict[str, Set[str]] = {}  # token -> local search cache keys
         self.redis_client = None
+        self.instance_id = uuid.uuid4().hex  # tags our own invalidation messages
+        self.invalidation_task = None
+        self.search_flight = SingleFlight()
+        self.speller = SymSpell(
+            max_words=Config.SPELL_MAX_WORDS,
+            max_bytes=Config.SPELL_MAX_MB << 20
+        )
+        self.search_index = SearchIndex()
+        self.ranker = BM25Ranker(
+            k1=Config.RANK_K1,
+            b=Config.RANK_B,
+            recency_boost=Config.RECENCY_BOOST,
+            recency_half_life=Config.RECENCY_HALF_LIFE * 86400,
+            preferred_quality=Config.PREFERRED_QUALITY,
+            quality_boost=Config.QUALITY_BOOST
+        )
+        # Words and word prefixes of every stored file name; saved to disk
+        # so it can screen queries before the startup warm-up finishes
+        self.vocabulary = BloomFilter.load(Config.BLOOM_PATH, Config.BLOOM_CAPACITY, Config.BLOOM_ERROR_RATE)
+        self.vocabulary_ready = self.vocabulary is not None
+        if self.vocabulary is None:
+            self.vocabulary = BloomFilter(Config.BLOOM_CAPACITY, Config.BLOOM_ERROR_RATE)
+        self.warm_task = None
         
     async def initialize(self):
         """Initialize all 4 database connections with connection pooling"""
@@ -33,44 +80,191 @@ class DatabaseManager:
         
         for i, uri in enumerate(db_uris):
             if uri:
-                try:
-                    client = AsyncIOMotorClient(
-                        uri,
-                        maxPoolSize=Config.MAX_POOL_SIZE,
-                        minPoolSize=Config.MIN_POOL_SIZE,
-                        maxIdleTimeMS=30000,
-                        waitQueueTimeoutMS=5000,
-                        serverSelectionTimeoutMS=5000
-                    )
-                    
-                    # Test connection
-                    await client.admin.command('ping')
-                    
-                    database = client[Config.DATABASE_NAME]
-                    collection = database[Config.COLLECTION_NAME]
-                    
-                    # Create indexes for faster queries
-                    await collection.create_index([("file_name", "text")])
-                    await collection.create_index("file_id")
-                    await collection.create_index("chat_id")
-                    
-                    self.clients.append(client)
-                    self.databases.append(database)
-                    self.collections.append(collection)
-                    
-                    logger.info(f"Database {i+1} connected successfully")
-                    
-                except Exception as e:
-                    logger.error(f"Failed to connect to database {i+1}: {e}")
+                # Placement is over configured slots, so a shard that is down
+                # at startup does not reshuffle ownership of every file
+                self.ring.add_node(i)
+                self.health[i] = ShardHealth(
+                    error_threshold=Config.SHARD_ERROR_THRESHOLD,
+                    slow_ms=Config.SHARD_SLOW_MS,
+                    cooldown=Config.SHARD_COOLDOWN
+                )
+                if not await self._connect_shard(i, uri):
+                    self.pending_uris[i] = uri
+        
+        # Keep retrying failed shards and probing open circuits
+        self.reconnect_task = asyncio.create_task(self._monitor_shards())
+        
+        # Build in-memory search structures from what is already indexed
+        self.warm_task = asyncio.create_task(self._warm_search_structures(list(self.shards), startup=True))
         
         # Initialize Redis for caching
         try:
             self.redis_client = redis.from_url(Config.REDIS_URL)
             await self.redis_client.ping()
             logger.info("Redis connected successfully")
+            self.invalidation_task = asyncio.create_task(self._listen_invalidations())
         except Exception as e:
             logger.error(f"Redis connection failed: {e}")
     
+    async def _ensure_unique_file_id(self, collection, i: int):
+        """Make file_id unique per shard, so re-indexing counts duplicates
+        
+        An older non-unique index is replaced. If the shard already holds
+        duplicate copies the unique build fails; a plain index is kept then
+        until the copies are removed.
+        """
+        indexes = await collection.index_information()
+        existing = indexes.get("file_id_1")
+        if existing and existing.get("unique"):
+            return
+        if existing:
+            await collection.drop_index("file_id_1")
+        try:
+            await collection.create_index("file_id", unique=True)
+        except OperationFailure as e:
+            logger.error(f"Database {i+1} has duplicate file_ids, file_id index is not unique: {e}")
+            await collection.create_index("file_id")
+    
+    async def _connect_shard(self, i: int, uri: str) -> bool:
+        """Connect one database, create its indexes and add it as a shard"""
+        client = None
+        try:
+            client = AsyncIOMotorClient(
+                uri,
+                maxPoolSize=Config.MAX_POOL_SIZE,
+                minPoolSize=Config.MIN_POOL_SIZE,
+                maxIdleTimeMS=30000,
+                waitQueueTimeoutMS=5000,
+                serverSelectionTimeoutMS=5000
+            )
+            
+            # Test connection
+            await client.admin.command('ping')
+            
+            database = client[Config.DATABASE_NAME]
+            collection = database[Config.COLLECTION_NAME]
+            
+            # Create indexes for faster queries
+            await collection.create_index([("file_name", "text")])
+            await self._ensure_unique_file_id(collection, i)
+            await collection.create_index("chat_id")
+            await collection.create_index("tokens")
+            await collection.create_index("prefixes")
+            await collection.create_index("year")
+            await collection.create_index("quality")
+            await collection.create_index([("season", 1), ("episode", 1)])
+            
+            self.clients.append(client)
+            self.databases.append(database)
+            self.collections.append(collection)
+            self.shards[i] = collection
+            
+            logger.info(f"Database {i+1} connected successfully")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to connect to database {i+1}: {e}")
+            if client:
+                client.close()
+            return False
+    
+    async def _monitor_shards(self):
+        """Reconnect failed databases and probe shards with open circuits"""
+        while True:
+            await asyncio.sleep(Config.SHARD_RETRY_INTERVAL)
+            
+            for i, uri in list(self.pending_uris.items()):
+                if await self._connect_shard(i, uri):
+                    self.health[i].record_success(0.0)
+                    # Load its files before the memory index counts as complete
+                    await self._warm_search_structures([i])
+                    del self.pending_uris[i]
+            
+            for i, collection in list(self.shards.items()):
+                health = self.health[i]
+                if health.state == CLOSED or not health.allow():
+                    continue
+                start = time.monotonic()
+                try:
+                    await collection.database.client.admin.command('ping')
+                    health.record_success((time.monotonic() - start) * 1000)
+                except Exception as e:
+                    health.record_failure()
+                    logger.warning(f"Database {i+1} still unhealthy: {e}")
+    
+    async def _warm_search_structures(self, shard_ids: List[int], startup: bool = False):
+        """Feed every stored file into the in-memory search structures"""
+        complete = True
+        for shard_id in shard_ids:
+            loaded = 0
+            try:
+                cursor = self.shards[shard_id].find(
+                    {}, {'_id': 0, 'file_id': 1, 'file_name': 1, 'file_size': 1, 'file_type': 1, 'tokens': 1,
+                         'year': 1, 'quality': 1, 'season': 1, 'date': 1}
+                )
+                async for doc in cursor.batch_size(5000):
+                    self._index_document(doc)
+                    loaded += 1
+                logger.info(f"Loaded {loaded} files from database {shard_id + 1}")
+            except Exception as e:
+                complete = False
+                logger.error(f"Error loading files from database {shard_id + 1}: {e}")
+        
+        if startup and complete:
+            self.search_index.ready = Config.MEMORY_INDEX
+            self.vocabulary_ready = True
+            await self.save_vocabulary()
+    
+    def _index_document(self, doc: Dict):
+        """Add a stored file to the in-memory search structures"""
+        # Files already indexed arrive again when a resync reloads the shards
+        if Config.MEMORY_INDEX and doc.get('file_id') in self.search_index:
+            return
+        tokens = doc.get('tokens')
+        if tokens is None:
+            # Saved before the search fields existed and not backfilled yet
+            doc = dict(doc, **search_fields(doc.get('file_name')))
+            tokens = doc['tokens']
+        for token in tokens:
+            self.speller.add_word(token)
+            self.vocabulary.add(token)
+            if len(token) > VOCABULARY_PREFIX:
+                self.vocabulary.add(token[:VOCABULARY_PREFIX])
+        self.ranker.add(tokens)
+        if Config.MEMORY_INDEX:
+            self.search_index.add(doc)
+    
+    def may_match(self, query: str) -> bool:
+        """False only when no word of the query can match any stored file
+        
+        A word matches whole, or as a partial word through its first
+        letters, so queries the prefix search would answer still pass.
+        """
+        if not self.vocabulary_ready:
+            return True
+        words = tokenize(query)
+        if not words:
+            return True
+        return any(
+            word in self.vocabulary
+            or (len(word) > VOCABULARY_PREFIX and word[:VOCABULARY_PREFIX] in self.vocabulary)
+            for word in words
+        )
+    
+    async def save_vocabulary(self):
+        """Persist the vocabulary filter for the next startup"""
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.vocabulary.save, Config.BLOOM_PATH)
+        except Exception as e:
+            logger.error(f"Error saving vocabulary filter: {e}")
+    
+    def readable_shards(self, shard_ids: Iterable[int] = None) -> List[int]:
+        """Connected shard ids whose circuit allows reads, in the given order"""
+        if shard_ids is None:
+            shard_ids = list(self.shards)
+        return [i for i in shard_ids if i in self.shards and self.health[i].allow()]
+    
     def get_collection(self):
         """Get collection with load balancing"""
         if not self.collections:
@@ -80,8 +274,8 @@ class DatabaseManager:
         self.current_db = (self.current_db + 1) % len(self.collections)
         return collection
     
-    async def save_file(self, media):
-        """Save file to database with load balancing"""
+    def _build_file_data(self, media) -> Dict:
+        """Build the document stored for a media object"""
         file_id, file_ref = unpack_new_file_id(media.file_id)
         
         file_data = {
@@ -97,210 +291,936 @@ class DatabaseManager:
             'date': media.date
         }
         
-        # Try to save to multiple databases for redundancy
+        # Parse once here so searches never re-parse the name
+        file_data.update(search_fields(media.file_name))
+        return file_data
+    
+    def get_placement(self, file_id: str) -> List[int]:
+        """Connected shard ids for a file, owner first, in ring order"""
+        return [shard_id for shard_id in self.ring.get_nodes(file_id) if shard_id in self.shards]
+    
+    async def save_file(self, media):
+        """Save file to database with load balancing"""
+        file_data = self._build_file_data(media)
+        
+        # Write to the owning shard, falling back along the ring
         saved = False
-        for collection in self.collections:
+        for shard_id in self.get_placement(file_data['file_id']):
             try:
-                await collection.insert_one(file_data)
+                await self.shards[shard_id].insert_one(file_data)
                 saved = True
                 break
             except DuplicateKeyError:
-                pass
+                # Already stored on its owner; do not copy it further along the ring
+                break
             except Exception as e:
                 logger.error(f"Error saving to database: {e}")
                 continue
         
         if saved:
+            self._index_document(file_data)
             # Clear cache for this query pattern
-            await self.clear_search_cache(media.file_name)
+            await self.clear_search_cache(media.file_name, [file_data])
         
         return saved
     
-    async def get_search_results(self, query: str, file_type: str = None, max_results: int = Config.MAX_RESULTS):
-        """Fast search with caching and load balancing"""
-        cache_key = f"search:{query}:{file_type}:{max_results}"
+    async def save_files(self, media_list: List) -> Dict[str, int]:
+        """Save a batch of files with unordered bulk inserts per owning shard
         
-        # Check Redis cache first
-        if self.redis_client:
+        Returns counts of saved, duplicate and failed documents. Duplicate
+        key errors inside the batch are counted instead of aborting it.
+        """
+        counts = {'saved': 0, 'duplicates': 0, 'errors': 0}
+        if not media_list:
+            return counts
+        
+        documents = []
+        for media in media_list:
             try:
-                cached_result = await self.redis_client.get(cache_key)
-                if cached_result:
-                    import json
-                    return json.loads(cached_result)
+                documents.append(self._build_file_data(media))
             except Exception as e:
-                logger.error(f"Redis get error: {e}")
+                counts['errors'] += 1
+                logger.error(f"Error preparing file for database: {e}")
         
-        # Check local cache
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+        if not documents:
+            return counts
         
-        # Search in databases
-        results = []
-        search_tasks = []
+        # Group by owning shard; a group whose shard fails moves on to
+        # the next shard in each document's ring order
+        inserted = []
+        pending = [(doc, self.get_placement(doc['file_id'])) for doc in documents]
+        while pending:
+            groups = {}
+            for doc, placement in pending:
+                if placement:
+                    groups.setdefault(placement[0], []).append((doc, placement))
+                else:
+                    counts['errors'] += 1
+            
+            results = await asyncio.gather(
+                *[self._bulk_insert(self.shards[shard_id], [doc for doc, _ in items], inserted)
+                  for shard_id, items in groups.items()],
+                return_exceptions=True
+            )
+            
+            pending = []
+            for (shard_id, items), result in zip(groups.items(), results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error bulk saving to database {shard_id + 1}: {result}")
+                    pending.extend((doc, placement[1:]) for doc, placement in items)
+                    continue
+                for key, value in result.items():
+                    counts[key] += value
         
-        for collection in self.collections:
-            task = self._search_in_collection(collection, query, file_type, max_results)
-            search_tasks.append(task)
+        for doc in inserted:
+            self._index_document(doc)
         
-        # Execute searches concurrently
-        search_results = await asyncio.gather(*search_tasks, return_exceptions=True)
+        if counts['saved']:
+            # Invalidate once for the whole batch instead of once per file
+            await self.clear_search_cache([doc['file_name'] for doc in inserted], inserted)
         
-        # Combine results from all databases
-        seen_file_ids = set()
-        for result in search_results:
-            if isinstance(result, list):
-                for file_doc in result:
-                    if file_doc['file_id'] not in seen_file_ids:
-                        results.append(file_doc)
-                        seen_file_ids.add(file_doc['file_id'])
-                        
-                        if len(results) >= max_results:
-                            break
+        return counts
+    
+    async def _bulk_insert(self, collection, documents: List[Dict], inserted: List[Dict] = None) -> Dict[str, int]:
+        """Unordered insert_many that counts duplicate key errors
+        
+        Documents that were actually written are appended to inserted.
+        """
+        try:
+            result = await collection.insert_many(documents, ordered=False)
+            if inserted is not None:
+                inserted.extend(documents)
+            return {'saved': len(result.inserted_ids), 'duplicates': 0, 'errors': 0}
+        except BulkWriteError as e:
+            details = e.details or {}
+            write_errors = details.get('writeErrors', [])
+            if inserted is not None:
+                failed = {err.get('index') for err in write_errors}
+                inserted.extend(doc for i, doc in enumerate(documents) if i not in failed)
+            duplicates = sum(1 for err in write_errors if err.get('code') == 11000)
+            return {
+                'saved': details.get('nInserted', 0),
+                'duplicates': duplicates,
+                'errors': len(write_errors) - duplicates
+            }
+    
+    async def get_search_results(self, query: str, file_type: str = None, max_results: int = Config.MAX_RESULTS,
+                                 filters: Dict = None):
+        """Fast search with caching and load balancing
+        
+        filters narrows results by any of FACETS, e.g. {'quality': '1080p'}.
+        """
+        filters = self._search_filters(file_type, filters)
+        cache_key = f"search:{normalize_query(query)}:{self._filters_key(filters)}:{max_results}"
+        
+        # Concurrent identical searches share one cache lookup and fan-out
+        return await self.search_flight.do(
+            cache_key,
+            lambda: self._load_search_results(cache_key, query, filters, max_results)
+        )
+    
+    @staticmethod
+    def _search_filters(file_type: Optional[str], filters: Optional[Dict]) -> Dict:
+        filters = {key: value for key, value in (filters or {}).items() if key in FACETS and value is not None}
+        if file_type:
+            filters['file_type'] = file_type
+        return filters
+    
+    @staticmethod
+    def _filters_key(filters: Dict) -> str:
+        return ",".join(f"{key}={filters[key]}" for key in sorted(filters)) or "None"
+    
+    def get_completions(self, query: str, offset: int = 0, limit: int = 20) -> List[Dict]:
+        """Inline-mode results for a partly typed query, from memory only"""
+        if not self.search_index.ready:
+            return []
+        return self.search_index.complete(query, offset, limit)
+    
+    async def get_facets(self, query: str, filters: Dict = None) -> Dict[str, List[tuple]]:
+        """Value counts per facet for a search, most common values first
+        
+        Counts come from the memory index when it is complete, otherwise
+        from one $facet aggregation per shard, summed across shards.
+        """
+        filters = self._search_filters(None, filters)
+        cache_key = f"facets:{normalize_query(query)}:{self._filters_key(filters)}"
+        
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        if self.search_index.ready and not self.pending_uris:
+            counts = self.search_index.facets(query, filters)
+        else:
+            shard_counts = await asyncio.gather(*[
+                self._facets_with_deadline(shard_id, query, filters)
+                for shard_id in self.readable_shards()
+            ])
+            counts = {facet: {} for facet in FACETS}
+            for result in shard_counts:
+                for facet, values in result.items():
+                    for value, count in values.items():
+                        counts[facet][value] = counts[facet].get(value, 0) + count
+        
+        facets = {
+            facet: sorted(values.items(), key=lambda item: item[1], reverse=True)[:FACET_VALUES]
+            for facet, values in counts.items()
+        }
+        
+        self.cache[cache_key] = facets
+        self._register_search_key(cache_key, cache_tokens(query, VOCABULARY_PREFIX) or {MATCH_ALL_TOKEN})
+        return facets
+    
+    async def _facets_with_deadline(self, shard_id: int, query: str, filters: Dict) -> Dict[str, Dict]:
+        """Run the $facet aggregation on one shard under SHARD_TIMEOUT"""
+        pipeline = []
+        match = self._match_stage(query, filters)
+        if match:
+            pipeline.append({"$match": match})
+        pipeline.append({"$facet": {
+            facet: [
+                {"$match": {facet: {"$ne": None}}},
+                {"$sortByCount": f"${facet}"},
+                {"$limit": FACET_VALUES * 2}
+            ]
+            for facet in FACETS
+        }})
+        
+        health = self.health[shard_id]
+        start = time.monotonic()
+        try:
+            cursor = self.shards[shard_id].aggregate(pipeline, maxTimeMS=int(Config.SHARD_TIMEOUT * 1000))
+            result = await asyncio.wait_for(cursor.to_list(length=1), timeout=Config.SHARD_TIMEOUT)
+            health.record_success((time.monotonic() - start) * 1000)
+        except Exception as e:
+            health.record_failure()
+            logger.error(f"Facet error in database {shard_id + 1}: {e}")
+            return {}
+        
+        if not result:
+            return {}
+        return {
+            facet: {bucket['_id']: bucket['count'] for bucket in buckets}
+            for facet, buckets in result[0].items()
+        }
+    
+    @staticmethod
+    def _match_stage(query: str, filters: Dict) -> Dict:
+        """$match conditions for a text query plus exact facet filters"""
+        match = dict(filters)
+        if query:
+            match["$text"] = {"$search": query}
+        return match
+    
+    async def _load_search_results(self, cache_key: str, query: str, filters: Dict, max_results: int):
+        """Resolve a search from the local cache, Redis or the databases"""
+        tokens = cache_tokens(query, VOCABULARY_PREFIX) or {MATCH_ALL_TOKEN}
+        
+        # Near cache: no round-trip, no decoding
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Far cache shared by every bot instance
+        if self.redis_client:
+            try:
+                results = unpack_results(await self.redis_client.get(cache_key))
+                if results is not None:
+                    self.cache[cache_key] = results
+                    self._register_search_key(cache_key, tokens)
+                    return results
+            except Exception as e:
+                logger.error(f"Redis get error: {e}")
+        
+        # The in-memory index answers without a round-trip once it holds
+        # every shard; Mongo stays the source of truth and the fallback
+        results = []
+        complete = True
+        if self.search_index.ready and not self.pending_uris:
+            results = self.search_index.search(query, filters, max_results)
+        
+        if not results:
+            # Scatter to every shard, each under its own deadline
+            search_results, complete = await self._scatter_search(query, filters, max_results)
             
-            if len(results) >= max_results:
-                break
+            # Gather: global top-k by text score, deduplicated during the merge
+            results = self._merge_results(search_results, max_results)
+            
+            # Whole words found nothing: retry as prefix/partial matches
+            if not results and query:
+                search_results, complete = await self._scatter_search(query, filters, max_results, prefix=True)
+                results = self._merge_results(search_results, max_results)
+        
+        # BM25 over the collection's term statistics, whichever engine found them
+        results = self.ranker.rank(query, results)
         
-        # Sort by relevance (file name similarity)
-        results.sort(key=lambda x: self._calculate_relevance(query, x['file_name']), reverse=True)
-        results = results[:max_results]
+        # Results missing a shard are served but not cached, so the files
+        # on it show up again as soon as it answers
+        if not complete:
+            return results
         
-        # Cache results
+        # Cache results, indexed by the tokens a new file would have to share
         self.cache[cache_key] = results
+        self._register_search_key(cache_key, tokens)
         
         # Cache in Redis
         if self.redis_client:
             try:
-                import json
-                await self.redis_client.setex(
-                    cache_key, 
-                    Config.CACHE_TIME, 
-                    json.dumps(results, default=str)
-                )
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.setex(cache_key, Config.CACHE_TIME, pack_results(results))
+                for token in tokens:
+                    pipe.sadd(f"searchtok:{token}", cache_key)
+                    pipe.expire(f"searchtok:{token}", Config.CACHE_TIME)
+                await pipe.execute()
             except Exception as e:
                 logger.error(f"Redis set error: {e}")
         
         return results
     
-    async def _search_in_collection(self, collection, query: str, file_type: str, max_results: int):
-        """Search in a specific collection"""
-        try:
-            # Build search pipeline for better performance
-            pipeline = []
-            
-            # Text search stage
-            if query:
-                pipeline.append({
-                    "$match": {
-                        "$text": {"$search": query}
-                    }
-                })
-            
-            # File type filter
-            if file_type:
-                pipeline.append({
-                    "$match": {"file_type": file_type}
-                })
-            
-            # Add score for text search relevance
-            if query:
-                pipeline.append({
-                    "$addFields": {
-                        "score": {"$meta": "textScore"}
-                    }
-                })
-                pipeline.append({
-                    "$sort": {"score": {"$meta": "textScore"}}
-                })
+    async def get_search_page(self, query: str, cursor: tuple = None, page_size: int = Config.MAX_LIST_ELM,
+                              filters: Dict = None, skip_ids: Set[str] = frozenset()):
+        """Fetch one page of results past a keyset cursor
+        
+        Every shard returns at most a few pages worth of documents after the
+        cursor, so the cost of a page does not depend on how deep it is.
+        Returns the page and the cursor for the next one, or None at the end.
+        The cursor also records whether the pages come from the prefix
+        fallback, so later pages keep using the same engine and scores.
+        """
+        filters = self._search_filters(None, filters)
+        page = []
+        seen = set()
+        prefix = False
+        if cursor is not None:
+            score, last_id, prefix = cursor
+            cursor = (score, last_id)
+        first = cursor is None
+        
+        while len(page) < page_size:
+            # Starting from the top, one fetch steps over every skipped hit
+            batch = len(skip_ids) + page_size if cursor is None else page_size * 2
+            shard_results, _ = await self._scatter_search(query, filters, batch, cursor, prefix)
+            shard_results = [result for result in shard_results if result is not None]
             
-            # Limit results
-            pipeline.append({"$limit": max_results})
+            # Whole words found nothing: page through prefix matches instead
+            if first and not prefix and query and not any(shard_results):
+                prefix = True
+                continue
+            first = False
+            exhausted = all(len(result) < batch for result in shard_results)
             
-            # Execute aggregation pipeline
-            cursor = collection.aggregate(pipeline)
-            return await cursor.to_list(length=max_results)
+            # The first `batch` merged documents are exactly the global
+            # next `batch`, since each shard supplied its own first `batch`
+            merged = heapq.merge(*shard_results, key=lambda doc: (-doc.get('score', 0.0), doc['_id']))
+            consumed = 0
+            for doc in merged:
+                if consumed >= batch or len(page) >= page_size:
+                    break
+                consumed += 1
+                cursor = (doc.get('score', 0.0), doc['_id'])
+                if doc['file_id'] in skip_ids or doc['file_id'] in seen:
+                    continue
+                seen.add(doc['file_id'])
+                page.append(doc)
             
+            if consumed == 0 or (exhausted and consumed >= sum(len(result) for result in shard_results)):
+                return page, None
+        
+        return page, cursor + (prefix,)
+    
+    async def _scatter_search(self, query: str, filters: Dict, max_results: int,
+                              after: tuple = None, prefix: bool = False) -> Tuple[List[Optional[List[Dict]]], bool]:
+        """Search every readable shard; also whether all configured shards answered"""
+        shard_ids = self.readable_shards()
+        shard_results = await asyncio.gather(*[
+            self._search_with_deadline(shard_id, self.shards[shard_id], query, filters, max_results, after, prefix)
+            for shard_id in shard_ids
+        ])
+        complete = (bool(shard_ids) and len(shard_ids) == len(self.shards) and not self.pending_uris
+                    and all(result is not None for result in shard_results))
+        return shard_results, complete
+    
+    async def _search_with_deadline(self, shard_id: int, collection, query: str, filters: Dict, max_results: int,
+                                    after: tuple = None, prefix: bool = False) -> Optional[List[Dict]]:
+        """Search one shard, giving up on it after SHARD_TIMEOUT; None if it failed"""
+        health = self.health[shard_id]
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                self._search_in_collection(collection, query, filters, max_results, after, prefix),
+                timeout=Config.SHARD_TIMEOUT
+            )
+            health.record_success((time.monotonic() - start) * 1000)
+            return result
+        except asyncio.TimeoutError:
+            health.record_failure((time.monotonic() - start) * 1000)
+            logger.warning(f"Search timed out on database {shard_id + 1}")
         except Exception as e:
-            logger.error(f"Search error in collection: {e}")
-            return []
+            health.record_failure()
+            logger.error(f"Search error in database {shard_id + 1}: {e}")
+        return None
+    
+    @staticmethod
+    def _merge_results(shard_results: List[List[Dict]], max_results: int) -> List[Dict]:
+        """Heap-merge score-sorted shard results into a deduplicated top-k"""
+        streams = [result for result in shard_results if isinstance(result, list)]
+        merged = heapq.merge(*streams, key=lambda doc: -doc.get('score', 0.0))
+        
+        results = []
+        seen_file_ids = set()
+        for file_doc in merged:
+            if file_doc['file_id'] in seen_file_ids:
+                continue
+            seen_file_ids.add(file_doc['file_id'])
+            results.append(file_doc)
+            if len(results) >= max_results:
+                break
+        
+        return results
     
-    def _calculate_relevance(self, query: str, filename: str) -> float:
-        """Calculate relevance score for sorting"""
-        query_lower = query.lower()
-        filename_lower = filename.lower()
+    async def _search_in_collection(self, collection, query: str, filters: Dict, max_results: int,
+                                    after: tuple = None, prefix: bool = False):
+        """Search in a specific collection
+        
+        Queries go to the text index; with prefix set, partial words
+        ("aveng", "spider-m") match the indexed edge n-grams instead.
+        Results are ordered by (score desc, _id asc); after resumes from a
+        (score, _id) keyset cursor instead of skipping earlier results.
+        """
+        if prefix and query:
+            return await self._prefix_search_in_collection(collection, query, filters, max_results, after)
         
-        # Exact match gets highest score
-        if query_lower == filename_lower:
-            return 1.0
+        # Build search pipeline for better performance
+        pipeline = []
         
-        # Starts with query gets high score
-        if filename_lower.startswith(query_lower):
-            return 0.9
+        # Text search stage with exact filters (file type, year, quality, season)
+        match = self._match_stage(query, filters)
+        if match:
+            pipeline.append({"$match": match})
         
-        # Contains query gets medium score
-        if query_lower in filename_lower:
-            return 0.7
+        # Add score for text search relevance
+        if query:
+            pipeline.append({
+                "$addFields": {
+                    "score": {"$meta": "textScore"}
+                }
+            })
         
-        # Word match gets lower score
-        query_words = query_lower.split()
-        filename_words = filename_lower.split()
+        # Keyset cursor: strictly after the last result already served
+        if after:
+            score, last_id = after
+            if query:
+                pipeline.append({"$match": {"$or": [
+                    {"score": {"$lt": score}},
+                    {"score": score, "_id": {"$gt": last_id}}
+                ]}})
+            else:
+                pipeline.append({"$match": {"_id": {"$gt": last_id}}})
         
-        matches = sum(1 for word in query_words if word in filename_words)
-        if matches > 0:
-            return 0.5 + (matches / len(query_words)) * 0.2
+        if query:
+            pipeline.append({
+                "$sort": {"score": {"$meta": "textScore"}, "_id": 1}
+            })
+        elif after:
+            pipeline.append({"$sort": {"_id": 1}})
         
-        return 0.0
+        # Limit results, keeping only what results are cached and ranked with
+        pipeline.append({"$limit": max_results})
+        pipeline.append({"$project": SEARCH_PROJECTION})
+        
+        # Execute aggregation pipeline; the server stops at the deadline too
+        cursor = collection.aggregate(pipeline, maxTimeMS=int(Config.SHARD_TIMEOUT * 1000))
+        return await cursor.to_list(length=max_results)
     
-    async def clear_search_cache(self, filename: str):
-        """Clear cache entries related to a filename"""
+    async def _prefix_search_in_collection(self, collection, query: str, filters: Dict, max_results: int,
+                                           after: tuple = None):
+        """Match every query word as a prefix of some word in the file name"""
+        words = [word[:PREFIX_LENGTH] for word in tokenize(query) if len(word) >= 2]
+        if not words:
+            return []
+        
+        pipeline = [
+            {"$match": dict(filters, prefixes={"$all": words})},
+            # Whole-word hits rank above pure prefix hits
+            {"$addFields": {"score": {"$add": [
+                0.5,
+                {"$size": {"$setIntersection": [{"$ifNull": ["$tokens", []]}, words]}}
+            ]}}}
+        ]
+        
+        if after:
+            score, last_id = after
+            pipeline.append({"$match": {"$or": [
+                {"score": {"$lt": score}},
+                {"score": score, "_id": {"$gt": last_id}}
+            ]}})
+        
+        pipeline.append({"$sort": {"score": -1, "_id": 1}})
+        pipeline.append({"$limit": max_results})
+        pipeline.append({"$project": SEARCH_PROJECTION})
+        
+        cursor = collection.aggregate(pipeline, maxTimeMS=int(Config.SHARD_TIMEOUT * 1000))
+        return await cursor.to_list(length=max_results)
+    
+    def _register_search_key(self, cache_key: str, tokens: Set[str]):
+        """Link a locally cached search to its query tokens"""
+        for token in tokens:
+            keys = self.search_tokens.setdefault(token, set())
+            keys.add(cache_key)
+        
+        # Drop links to entries the cache has already expired or evicted
+        if len(self.search_tokens) > len(self.cache) * 8 + 1000:
+            for token in list(self.search_tokens):
+                live = {key for key in self.search_tokens[token] if key in self.cache}
+                if live:
+                    self.search_tokens[token] = live
+                else:
+                    del self.search_tokens[token]
+    
+    async def clear_search_cache(self, filenames: Union[str, Iterable[str], None] = None,
+                                 documents: List[Dict] = None):
+        """Evict cached searches that new files could match
+        
+        Only queries with a word starting like one of the filenames' words
+        are evicted, plus token-less queries that match everything. Passing None flushes
+        every search entry. The new documents travel with the invalidation,
+        so other instances add them to their memory structures too.
+        """
+        if filenames is None:
+            await self._flush_search_cache()
+            return
+        
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        
+        tokens = {MATCH_ALL_TOKEN}
+        for filename in filenames:
+            tokens |= invalidation_tokens(filename, VOCABULARY_PREFIX)
+        
+        self._evict_local(tokens)
+        
+        # Redis: fetch every token's key set in one round-trip, unlink in another
         if self.redis_client:
             try:
-                # Get all keys matching search pattern
-                keys = await self.redis_client.keys("search:*")
+                token_keys = [f"searchtok:{token}" for token in tokens]
+                pipe = self.redis_client.pipeline(transaction=False)
+                for token_key in token_keys:
+                    pipe.smembers(token_key)
+                members = await pipe.execute()
+                
+                keys = set(token_keys)
+                for key_set in members:
+                    keys.update(key_set or ())
+                
+                pipe = self.redis_client.pipeline(transaction=False)
                 for key in keys:
-                    await self.redis_client.delete(key)
+                    pipe.unlink(key)
+                # Other instances drop their local copies too
+                pipe.publish(INVALIDATION_CHANNEL, pack_message({
+                    'origin': self.instance_id,
+                    'tokens': list(tokens),
+                    'files': index_rows(documents or [])
+                }))
+                await pipe.execute()
+            except Exception as e:
+                logger.error(f"Cache clear error: {e}")
+    
+    async def _flush_search_cache(self):
+        """Drop every cached search, locally and in Redis"""
+        self._evict_local(None)
+        
+        if self.redis_client:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                async for key in self.redis_client.scan_iter(match="search*", count=1000):
+                    pipe.unlink(key)
+                pipe.publish(INVALIDATION_CHANNEL, pack_message({'origin': self.instance_id, 'tokens': None}))
+                await pipe.execute()
             except Exception as e:
                 logger.error(f"Cache clear error: {e}")
     
+    def _evict_local(self, tokens: Optional[Set[str]]):
+        """Drop local searches linked to any of the tokens, or all for None"""
+        if tokens is None:
+            for keys in self.search_tokens.values():
+                for key in keys:
+                    self.cache.pop(key, None)
+            self.search_tokens.clear()
+            return
+        
+        for token in tokens:
+            for key in self.search_tokens.pop(token, ()):
+                self.cache.pop(key, None)
+    
+    async def _listen_invalidations(self):
+        """Apply search cache invalidations published by other instances
+        
+        Files saved by other instances are added to the memory structures
+        as they are announced. After a disconnect some may have been missed,
+        so the memory index stops answering until the shards are reloaded.
+        """
+        resync = False
+        while True:
+            pubsub = self.redis_client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                if resync:
+                    resync = False
+                    self.warm_task = asyncio.create_task(
+                        self._warm_search_structures(list(self.shards), startup=True)
+                    )
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    payload = unpack_message(message['data'])
+                    if payload.get('origin') == self.instance_id:
+                        continue
+                    for doc in index_documents(payload.get('files') or []):
+                        self._index_document(doc)
+                    tokens = payload.get('tokens')
+                    self._evict_local(None if tokens is None else set(tokens))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Anything published while disconnected is lost, so start clean
+                logger.error(f"Cache invalidation listener error: {e}")
+                self._evict_local(None)
+                if Config.MEMORY_INDEX:
+                    self.search_index.ready = False
+                    resync = True
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+    
     async def get_file_details(self, file_id: str):
-        """Get file details by file_id with caching"""
+        """Get file details by file_id with caching
+        
+        Misses in the local and Redis caches ask every readable shard at
+        once and take the first hit, so a file missing from its owner costs
+        one round-trip instead of one per shard.
+        """
         cache_key = f"file:{file_id}"
         
         # Check cache first
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+        cached = self.detail_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        cached = (await self._get_cached_details([file_id])).get(file_id)
+        if cached is not None:
+            return cached
+        
+        lookups = [
+            asyncio.ensure_future(self._find_details(shard_id, [file_id]))
+            for shard_id in self.readable_shards(self.get_placement(file_id))
+        ]
+        try:
+            for lookup in asyncio.as_completed(lookups):
+                docs = await lookup
+                if docs:
+                    await self._cache_details(docs)
+                    return docs[0]
+        finally:
+            for lookup in lookups:
+                lookup.cancel()
+        
+        return None
+    
+    async def _get_cached_details(self, file_ids: List[str]) -> Dict[str, Dict]:
+        """File details from the Redis tier, copied into the local cache"""
+        if not self.redis_client or not file_ids:
+            return {}
+        try:
+            values = await self.redis_client.mget([f"file:{file_id}" for file_id in file_ids])
+        except Exception as e:
+            logger.error(f"Redis get error: {e}")
+            return {}
         
-        # Search in all databases
-        for collection in self.collections:
+        found = {}
+        for file_id, value in zip(file_ids, values):
+            doc = unpack_document(value) if value else None
+            if doc is not None:
+                self.detail_cache[f"file:{file_id}"] = doc
+                found[file_id] = doc
+        return found
+    
+    async def _cache_details(self, docs: List[Dict]):
+        """Keep file details locally and in Redis"""
+        for doc in docs:
+            self.detail_cache[f"file:{doc['file_id']}"] = doc
+        
+        if self.redis_client and docs:
             try:
-                result = await collection.find_one({"file_id": file_id})
-                if result:
-                    self.cache[cache_key] = result
-                    return result
+                pipe = self.redis_client.pipeline(transaction=False)
+                for doc in docs:
+                    pipe.setex(f"file:{doc['file_id']}", Config.DETAIL_CACHE_TIME, pack_document(doc))
+                await pipe.execute()
             except Exception as e:
-                logger.error(f"Error getting file details: {e}")
-                continue
+                logger.error(f"Redis set error: {e}")
+    
+    def prefetch_details(self, file_ids: List[str]):
+        """Load details for a page about to be clicked, in the background"""
+        missing = [file_id for file_id in file_ids if f"file:{file_id}" not in self.detail_cache]
+        if missing:
+            task = asyncio.create_task(self.get_files_details(missing))
+            self.prefetch_tasks.add(task)
+            task.add_done_callback(self.prefetch_tasks.discard)
+    
+    async def get_files_details(self, file_ids: List[str]) -> Dict[str, Dict]:
+        """Details of several files, with one $in query per shard
         
-        return None
+        Each file is first asked of its owning shard; files not found there
+        are looked for on every other shard in a second round.
+        """
+        found = {}
+        missing = []
+        for file_id in dict.fromkeys(file_ids):
+            cached = self.detail_cache.get(f"file:{file_id}")
+            if cached is not None:
+                found[file_id] = cached
+            else:
+                missing.append(file_id)
+        
+        if missing:
+            found.update(await self._get_cached_details(missing))
+            missing = [file_id for file_id in missing if file_id not in found]
+        
+        by_owner: Dict[int, List[str]] = {}
+        for file_id in missing:
+            placement = self.readable_shards(self.get_placement(file_id))
+            if placement:
+                by_owner.setdefault(placement[0], []).append(file_id)
+        
+        await self._collect_details(by_owner, found)
+        
+        # Files saved before hash placement may live on any other shard
+        remaining = [file_id for file_id in missing if file_id not in found]
+        if remaining:
+            fallback = {}
+            for shard_id in self.readable_shards():
+                asked = set(by_owner.get(shard_id, ()))
+                ids = [file_id for file_id in remaining if file_id not in asked]
+                if ids:
+                    fallback[shard_id] = ids
+            await self._collect_details(fallback, found)
+        
+        return found
+    
+    async def _collect_details(self, shard_ids: Dict[int, List[str]], found: Dict[str, Dict]):
+        """Query each shard for its list of file ids at once, caching every new hit"""
+        results = await asyncio.gather(*[
+            self._find_details(shard_id, ids) for shard_id, ids in shard_ids.items()
+        ])
+        docs = [doc for shard_docs in results for doc in shard_docs if doc['file_id'] not in found]
+        for doc in docs:
+            found.setdefault(doc['file_id'], doc)
+        await self._cache_details(docs)
+    
+    async def _find_details(self, shard_id: int, file_ids: List[str]) -> List[Dict]:
+        """Documents for file_ids held by one shard"""
+        health = self.health[shard_id]
+        start = time.monotonic()
+        try:
+            cursor = self.shards[shard_id].find(
+                {"file_id": {"$in": file_ids}}, max_time_ms=int(Config.SHARD_TIMEOUT * 1000)
+            )
+            docs = await asyncio.wait_for(cursor.to_list(length=len(file_ids)), timeout=Config.SHARD_TIMEOUT)
+            health.record_success((time.monotonic() - start) * 1000)
+            return docs
+        except Exception as e:
+            health.record_failure()
+            logger.error(f"Error getting file details from database {shard_id + 1}: {e}")
+            return []
+    
+    async def rebalance_shards(self, batch_size: int = Config.BATCH_SIZE, progress=None) -> Dict[str, int]:
+        """Move documents to their hash owner shard in batches
+        
+        Documents whose owner is not connected stay where they are; moving
+        them along the ring would put them on the wrong shard for good.
+        """
+        counts = {'scanned': 0, 'moved': 0, 'skipped': 0, 'errors': 0}
+        
+        for shard_id, collection in list(self.shards.items()):
+            batch = {}
+            
+            async def flush():
+                for owner_id, docs in batch.items():
+                    try:
+                        result = await self._bulk_insert(self.shards[owner_id], docs)
+                        if result['errors']:
+                            # Keep the source copies if the owner rejected any
+                            counts['errors'] += result['errors']
+                            continue
+                        await collection.delete_many({"_id": {"$in": [doc['_id'] for doc in docs]}})
+                        counts['moved'] += len(docs)
+                    except Exception as e:
+                        counts['errors'] += len(docs)
+                        logger.error(f"Error moving files to database {owner_id + 1}: {e}")
+                batch.clear()
+                if progress:
+                    await progress(counts)
+            
+            try:
+                async for doc in collection.find({}, batch_size=batch_size):
+                    counts['scanned'] += 1
+                    owner_id = self.ring.get_node(doc['file_id'])
+                    if owner_id == shard_id:
+                        continue
+                    if owner_id not in self.shards:
+                        counts['skipped'] += 1
+                        continue
+                    
+                    batch.setdefault(owner_id, []).append(doc)
+                    if sum(len(docs) for docs in batch.values()) >= batch_size:
+                        await flush()
+                
+                await flush()
+            except Exception as e:
+                logger.error(f"Error rebalancing database {shard_id + 1}: {e}")
+        
+        return counts
+    
+    async def backfill_search_fields(self, batch_size: int = Config.BATCH_SIZE, progress=None) -> Dict[str, int]:
+        """Add the precomputed search fields to documents saved without them"""
+        counts = {'scanned': 0, 'updated': 0, 'errors': 0}
+        
+        for shard_id, collection in list(self.shards.items()):
+            batch = []
+            refreshed = []
+            
+            async def flush():
+                try:
+                    result = await collection.bulk_write(batch, ordered=False)
+                    counts['updated'] += result.modified_count
+                    # Memory rows loaded before the backfill get the parsed filter fields
+                    for doc in refreshed:
+                        self.search_index.refresh(doc)
+                except Exception as e:
+                    counts['errors'] += len(batch)
+                    logger.error(f"Error backfilling database {shard_id + 1}: {e}")
+                batch.clear()
+                refreshed.clear()
+                if progress:
+                    await progress(counts)
+            
+            try:
+                cursor = collection.find(
+                    {'$or': [{'tokens': {'$exists': False}}, {'prefixes': {'$exists': False}}]},
+                    {'file_id': 1, 'file_name': 1}
+                )
+                async for doc in cursor.batch_size(batch_size):
+                    counts['scanned'] += 1
+                    parsed = search_fields(doc.get('file_name'))
+                    batch.append(UpdateOne({'_id': doc['_id']}, {'$set': parsed}))
+                    refreshed.append(dict(parsed, file_id=doc.get('file_id')))
+                    if len(batch) >= batch_size:
+                        await flush()
+                
+                if batch:
+                    await flush()
+            except Exception as e:
+                logger.error(f"Error backfilling database {shard_id + 1}: {e}")
+        
+        if counts['updated']:
+            # Updated files can now match searches cached without them,
+            # under any query, so every instance drops every search
+            await self.clear_search_cache()
+        
+        return counts
     
     async def get_stats(self):
         """Get database statistics"""
         total_files = 0
-        for collection in self.collections:
-            try:
-                count = await collection.count_documents({})
-                total_files += count
-            except Exception as e:
-                logger.error(f"Error getting stats: {e}")
+        shards = []
+        for shard_id in sorted(self.health):
+            shard = {'id': shard_id + 1, 'files': None}
+            shard.update(self.health[shard_id].snapshot())
+            
+            if shard_id in self.pending_uris:
+                shard['state'] = "disconnected"
+            else:
+                try:
+                    shard['files'] = await self.shards[shard_id].count_documents({})
+                    total_files += shard['files']
+                except Exception as e:
+                    logger.error(f"Error getting stats: {e}")
+            shards.append(shard)
         
         return {
             'total_files': total_files,
+            'shards': shards,
             'active_databases': len(self.collections),
-            'cache_size': len(self.cache)
+            'cache_size': len(self.cache) + len(self.detail_cache),
+            'search_cache': self.cache.stats(),
+            'detail_cache': self.detail_cache.stats(),
+            'search_flights': self.search_flight.flights,
+            'search_coalesced': self.search_flight.coalesced,
+            'speller': self.speller.stats(),
+            'search_index': self.search_index.stats(),
+            'ranker': self.ranker.stats(),
+            'vocabulary': self.vocabulary.stats()
         }
 
 # Global database manager instance
 db = DatabaseManager()
 
+# Fields users can filter search results by
+FACETS = ['file_type', 'year', 'quality', 'season']
+FACET_VALUES = 8
+
+# Longest edge n-gram stored in the prefixes field
+PREFIX_LENGTH = 12
+
+# Fields a shard returns per search hit: what is cached, plus tokens for BM25
+SEARCH_PROJECTION = {'_id': 1, 'tokens': 1, **{field: 1 for field in RESULT_FIELDS}}
+
+# Redis channel carrying search cache invalidations between instances
+INVALIDATION_CHANNEL = "search:invalidate"
+
+# Leading letters of each word kept in the vocabulary filter and used to
+# link cached searches to the files that invalidate them
+VOCABULARY_PREFIX = 4
+
+QUALITY_PATTERN = re.compile(r'(?<![a-z0-9])(2160p|1440p|1080p|720p|576p|480p|360p|240p|4k)(?![a-z0-9])')
+CODEC_PATTERN = re.compile(r'(?<![a-z0-9])(x264|x265|h\.?264|h\.?265|hevc|avc|av1|xvid)(?![a-z0-9])')
+EPISODE_PATTERN = re.compile(r'(?<![a-z0-9])s(\d{1,2})[ ._-]?e(\d{1,3})(?![0-9])')
+SEASON_PATTERN = re.compile(r'(?<![a-z0-9])(?:s|season[ ._-]?)(\d{1,2})(?![0-9])')
+CODEC_NAMES = {'h264': 'x264', 'h.264': 'x264', 'avc': 'x264', 'h265': 'x265', 'h.265': 'x265', 'hevc': 'x265'}
+
+def search_fields(file_name: Optional[str]) -> Dict:
+    """Normalized title, tokens and release details parsed from a file name"""
+    name = re.sub(r'\.[a-z0-9]{2,4}$', '', (file_name or "").lower())
+    
+    _, year = extract_year(name)
+    quality = QUALITY_PATTERN.search(name)
+    codec = CODEC_PATTERN.search(name)
+    episode = EPISODE_PATTERN.search(name)
+    season = episode or SEASON_PATTERN.search(name)
+    
+    # Title: the name without release tags, year or season/episode markers
+    title = name
+    for pattern in (QUALITY_PATTERN, CODEC_PATTERN, EPISODE_PATTERN, SEASON_PATTERN):
+        title = pattern.sub(' ', title)
+    title = clean_filename(re.sub(r'[._]+', ' ', title))
+    title, _ = extract_year(title)
+    
+    # Repeats are kept: BM25 counts them as term frequency and name length
+    tokens = tokenize(name)
+    
+    return {
+        'title': normalize_query(title),
+        'tokens': tokens,
+        'prefixes': edge_ngrams(tokens, max_length=PREFIX_LENGTH),
+        'year': int(year) if year else None,
+        'quality': quality.group(1) if quality else None,
+        'codec': CODEC_NAMES.get(codec.group(1), codec.group(1)) if codec else None,
+        'season': int(season.group(1)) if season else None,
+        'episode': int(episode.group(2)) if episode else None
+    }
+
 def unpack_new_file_id(new_file_id):
     """Unpack new file_id to get file_id and file_ref"""
     import base64
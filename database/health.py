@@ -0,0 +1,91 @@
+import time
+from typing import Dict
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class ShardHealth:
+    """EWMA latency, error rate and circuit breaker state for one shard"""
+
+    def __init__(self, error_threshold: float, slow_ms: float, cooldown: float,
+                 alpha: float = 0.2, min_samples: int = 5):
+        self.error_threshold = error_threshold
+        self.slow_ms = slow_ms
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.min_samples = min_samples
+
+        self.state = CLOSED
+        self.latency_ms = 0.0
+        self.error_rate = 0.0
+        self.samples = 0
+        self.opened_at = 0.0
+        self.trial_started = 0.0
+
+    def allow(self) -> bool:
+        """Whether a read may be sent to this shard now"""
+        if self.state == CLOSED:
+            return True
+
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now - self.opened_at < self.cooldown:
+                return False
+            self.state = HALF_OPEN
+
+        # Half-open: let a single trial request through at a time
+        if self.trial_started and now - self.trial_started < self.cooldown:
+            return False
+        self.trial_started = now
+        return True
+
+    def record_success(self, latency_ms: float):
+        self._observe(latency_ms, 0.0)
+        if self.state != CLOSED and latency_ms < self.slow_ms:
+            self._close()
+        else:
+            self._evaluate()
+
+    def record_failure(self, latency_ms: float = None):
+        self._observe(latency_ms, 1.0)
+        if self.state == HALF_OPEN:
+            self._open()
+        else:
+            self._evaluate()
+
+    def _observe(self, latency_ms, error: float):
+        if self.samples == 0:
+            self.latency_ms = latency_ms or 0.0
+            self.error_rate = error
+        else:
+            if latency_ms is not None:
+                self.latency_ms += self.alpha * (latency_ms - self.latency_ms)
+            self.error_rate += self.alpha * (error - self.error_rate)
+        self.samples += 1
+
+    def _evaluate(self):
+        if self.samples < self.min_samples:
+            return
+        if self.error_rate >= self.error_threshold or self.latency_ms >= self.slow_ms:
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.trial_started = 0.0
+
+    def _close(self):
+        self.state = CLOSED
+        self.trial_started = 0.0
+        # Start the averages over so old failures do not reopen it at once
+        self.samples = 0
+        self.error_rate = 0.0
+
+    def snapshot(self) -> Dict:
+        return {
+            'state': self.state,
+            'latency_ms': round(self.latency_ms, 1),
+            'error_rate': round(self.error_rate, 3)
+        }
@@ -0,0 +1,185 @@
+import csv
+import gzip
+import hashlib
+import mmap
+import os
+import re
+import struct
+from typing import Dict, Optional
+
+from database.normalize import tokenize, STOP_WORDS
+
+MAGIC = b"IMDBIDX2"  # bumped when the key format changes
+HEADER = struct.Struct("<8sI")          # magic, entry count
+ENTRY = struct.Struct("<QHxxI")         # title hash, year, record offset
+RECORD = struct.Struct("<IHfIB")        # tconst number, year, rating, votes, kind
+
+TITLE_KINDS = {"movie": 0, "tvMovie": 1, "tvSeries": 2, "tvMiniSeries": 3}
+KIND_NAMES = {value: key for key, value in TITLE_KINDS.items()}
+
+YEAR_PATTERN = re.compile(r'^(19|20)\d{2}$')
+
+
+def title_hash(title_key: str) -> int:
+    """64-bit hash of a normalized title"""
+    return int.from_bytes(hashlib.blake2b(title_key.encode(), digest_size=8).digest(), "little")
+
+
+def title_key(tokens) -> str:
+    """Index key of a title: its words without stop words, as searches are cleaned"""
+    words = [token for token in tokens if token not in STOP_WORDS]
+    return " ".join(words or tokens)
+
+
+def _open_tsv(path: str):
+    opener = gzip.open if path.endswith(".gz") else open
+    return opener(path, "rt", encoding="utf-8", newline="")
+
+
+def build_index(basics_path: str, ratings_path: str, out_path: str, min_votes: int = 0) -> int:
+    """Build an index file from the title.basics and title.ratings dumps
+
+    The file is written next to out_path and moved into place atomically,
+    so readers never see a half-written index. Returns the title count.
+    """
+    ratings: Dict[int, tuple] = {}
+    with _open_tsv(ratings_path) as f:
+        for row in csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            votes = int(row["numVotes"])
+            if votes >= min_votes:
+                ratings[int(row["tconst"][2:])] = (float(row["averageRating"]), votes)
+
+    entries = []
+    records = bytearray()
+    with _open_tsv(basics_path) as f:
+        for row in csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            kind = TITLE_KINDS.get(row["titleType"])
+            if kind is None or row["isAdult"] == "1":
+                continue
+
+            tconst = int(row["tconst"][2:])
+            rating = ratings.get(tconst)
+            if rating is None:
+                continue
+
+            year = int(row["startYear"]) if row["startYear"].isdigit() else 0
+            genres = "" if row["genres"] == "\\N" else row["genres"]
+            title = row["primaryTitle"].encode()[:255]
+            genres = genres.encode()[:255]
+
+            offset = len(records)
+            records += RECORD.pack(tconst, year, rating[0], rating[1], kind)
+            records += bytes([len(title)]) + title + bytes([len(genres)]) + genres
+
+            keys = {title_key(tokenize(row["primaryTitle"])), title_key(tokenize(row["originalTitle"]))}
+            for key in keys:
+                if key:
+                    # Most voted title first among equal hashes
+                    entries.append((title_hash(key), -rating[1], year, offset))
+
+    entries.sort()
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries)))
+        for key_hash, _, year, offset in entries:
+            f.write(ENTRY.pack(key_hash, year, offset))
+        f.write(records)
+    os.replace(tmp_path, out_path)
+
+    return len(entries)
+
+
+class TitleIndex:
+    """Memory-mapped lookup of IMDb titles by normalized title and year"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not an IMDb title index of this version, rebuild it with /imdbrefresh: {path}")
+
+        self._entries_start = HEADER.size
+        self._records_start = HEADER.size + self.count * ENTRY.size
+
+    def _entry(self, i: int) -> tuple:
+        return ENTRY.unpack_from(self._map, self._entries_start + i * ENTRY.size)
+
+    def _record(self, offset: int) -> Dict:
+        position = self._records_start + offset
+        tconst, year, rating, votes, kind = RECORD.unpack_from(self._map, position)
+        position += RECORD.size
+        title_len = self._map[position]
+        title = self._map[position + 1:position + 1 + title_len].decode()
+        position += 1 + title_len
+        genres_len = self._map[position]
+        genres = self._map[position + 1:position + 1 + genres_len].decode()
+        return {
+            'imdb_id': f"tt{tconst:07d}",
+            'title': title,
+            'year': year or None,
+            'rating': round(rating, 1),
+            'votes': votes,
+            'kind': KIND_NAMES.get(kind, "movie"),
+            'genres': genres.split(",") if genres else []
+        }
+
+    def _find(self, key: str, year: Optional[int]) -> Optional[Dict]:
+        target = title_hash(key)
+
+        # Binary search for the first entry with this hash
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._entry(mid)[0] < target:
+                low = mid + 1
+            else:
+                high = mid
+
+        for i in range(low, self.count):
+            key_hash, entry_year, offset = self._entry(i)
+            if key_hash != target:
+                break
+            if year is None or entry_year == year:
+                return self._record(offset)
+
+        return None
+
+    def lookup(self, query: str) -> Optional[Dict]:
+        """Best title for a free-form query such as "avatar 2009 1080p"
+
+        Stop words are ignored, as in the index keys. A year after the title
+        narrows the match. Trailing words ("1080p", "hindi") are dropped one
+        at a time until a title matches.
+        """
+        tokens = [token for token in tokenize(query) if token not in STOP_WORDS]
+        year = None
+        for i, token in enumerate(tokens):
+            # A leading number is part of the title, as in "2012"
+            if i and YEAR_PATTERN.match(token):
+                year = int(token)
+                tokens = tokens[:i]
+                break
+
+        for length in range(len(tokens), 0, -1):
+            key = " ".join(tokens[:length])
+            if not key:
+                break
+            found = self._find(key, year)
+            if found is None and year is not None:
+                found = self._find(key, None)
+            if found is not None:
+                return found
+
+        return None
+
+    def close(self):
+        try:
+            self._map.close()
+        except Exception:
+            pass
+        self._file.close()
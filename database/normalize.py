@@ -0,0 +1,46 @@
+import re
+from typing import List, Set
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+# Queries with no tokens can match any file
+MATCH_ALL_TOKEN = "*"
+
+# Words dropped from search queries and from IMDb title keys alike
+STOP_WORDS = frozenset({'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by',
+                        'is', 'are', 'was', 'were'})
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lower-case alphanumeric tokens"""
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def cache_tokens(query: str, length: int) -> Set[str]:
+    """Keys linking a cached search to the files it could match: its words cut to length letters"""
+    return {token[:length] for token in tokenize(query)}
+
+
+def invalidation_tokens(text: str, length: int) -> Set[str]:
+    """Keys of every cached search a file could match: each word's prefixes up to length letters
+
+    A partial query ("aveng", "av") is linked under its own leading
+    letters, so files it matches by prefix still evict it.
+    """
+    return {token[:n] for token in tokenize(text) for n in range(1, min(len(token), length) + 1)}
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a search query for cache keys"""
+    return " ".join(tokenize(query))
+
+
+def edge_ngrams(tokens: List[str], min_length: int = 2, max_length: int = 12) -> List[str]:
+    """Distinct leading substrings of each token, for prefix matching"""
+    grams = {}
+    for token in tokens:
+        for length in range(min_length, min(len(token), max_length) + 1):
+            grams[token[:length]] = None
+    return list(grams)
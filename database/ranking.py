@@ -0,0 +1,107 @@
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from database.normalize import tokenize
+
+# Credit for a query word that only starts a file name word
+PREFIX_MATCH = 0.5
+
+
+def timestamp(value) -> Optional[float]:
+    """Epoch seconds of a stored file date, if it has one"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)) and value > 0:
+        return float(value)
+    return None
+
+
+class BM25Ranker:
+    """BM25 over stored file name tokens, with recency and quality boosts
+
+    Document frequencies are counted as files are indexed, so every query
+    term is weighted by how rare it is across the whole collection.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75,
+                 recency_boost: float = 0.0, recency_half_life: float = 30 * 86400,
+                 preferred_quality: str = "", quality_boost: float = 0.0):
+        self.k1 = k1
+        self.b = b
+        self.recency_boost = recency_boost
+        self.recency_half_life = recency_half_life
+        self.preferred_quality = preferred_quality.lower()
+        self.quality_boost = quality_boost
+
+        self.doc_freq: Dict[str, int] = {}
+        self.documents = 0
+        self.total_length = 0
+
+    def add(self, tokens: List[str]):
+        """Count the tokens of a newly indexed file"""
+        for token in set(tokens):
+            self.doc_freq[token] = self.doc_freq.get(token, 0) + 1
+        self.documents += 1
+        self.total_length += len(tokens)
+
+    def score(self, query: str, docs: List[Dict]) -> np.ndarray:
+        """BM25 score of each document for the query, boosts applied"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not docs or not terms:
+            return np.zeros(len(docs))
+
+        columns = {term: i for i, term in enumerate(terms)}
+        tf = np.zeros((len(docs), len(terms)))
+        lengths = np.empty(len(docs))
+        for row, doc in enumerate(docs):
+            tokens = doc.get('tokens')
+            if tokens is None:
+                tokens = tokenize(doc.get('file_name') or "")
+            lengths[row] = len(tokens)
+            for token in tokens:
+                column = columns.get(token)
+                if column is not None:
+                    tf[row, column] += 1
+            # Words still being typed ("aveng") score as partial matches
+            for column, term in enumerate(terms):
+                if not tf[row, column] and any(token.startswith(term) for token in tokens):
+                    tf[row, column] = PREFIX_MATCH
+
+        documents = max(self.documents, len(docs))
+        df = np.array([self.doc_freq.get(term, 0) for term in terms], dtype=float)
+        idf = np.log1p((documents - df + 0.5) / (df + 0.5))
+
+        average_length = self.total_length / self.documents if self.documents else max(lengths.mean(), 1.0)
+        norm = self.k1 * (1 - self.b + self.b * lengths / average_length)
+        scores = (tf * (self.k1 + 1) / (tf + norm[:, None])) @ idf
+
+        if self.recency_boost:
+            dates = np.array([timestamp(doc.get('date')) or np.nan for doc in docs])
+            ages = np.maximum(time.time() - dates, 0)
+            freshness = np.nan_to_num(0.5 ** (ages / self.recency_half_life))
+            scores *= 1 + self.recency_boost * freshness
+
+        if self.quality_boost and self.preferred_quality:
+            preferred = np.array([(doc.get('quality') or "").lower() == self.preferred_quality for doc in docs])
+            scores *= np.where(preferred, 1 + self.quality_boost, 1.0)
+
+        return scores
+
+    def rank(self, query: str, docs: List[Dict]) -> List[Dict]:
+        """Documents by BM25 score, the search engine's own score breaking ties"""
+        if len(docs) < 2:
+            return docs
+        scores = self.score(query, docs)
+        engine_scores = np.array([doc.get('score', 0.0) for doc in docs], dtype=float)
+        order = np.lexsort((-engine_scores, -scores))
+        return [docs[i] for i in order]
+
+    def stats(self) -> Dict:
+        return {
+            'documents': self.documents,
+            'terms': len(self.doc_freq),
+            'average_length': round(self.total_length / self.documents, 1) if self.documents else 0.0
+        }
@@ -0,0 +1,327 @@
+import bisect
+import heapq
+import math
+from array import array
+from typing import Dict, List, Optional
+
+from database.normalize import tokenize
+from database.ranking import timestamp
+
+FILE_TYPES = ['document', 'video', 'audio', 'photo', 'animation', 'voice', 'sticker', 'video_note']
+
+
+def trigrams(token: str) -> List[str]:
+    """Distinct character trigrams of a token"""
+    return list(dict.fromkeys(token[i:i + 3] for i in range(len(token) - 2)))
+
+
+class SearchIndex:
+    """In-memory token and trigram inverted index over file names
+
+    Each token owns a sorted uint32 posting array of document numbers, and a
+    trigram index over the token vocabulary resolves partial or misspelled
+    words ("avengr", "spider-m") to known tokens before their postings are
+    scored.
+    """
+
+    def __init__(self, fuzzy_threshold: float = 0.5, fuzzy_expansions: int = 5, prefix_expansions: int = 32):
+        self.fuzzy_threshold = fuzzy_threshold
+        self.fuzzy_expansions = fuzzy_expansions
+        self.prefix_expansions = prefix_expansions
+        self.ready = False
+
+        # Per-document columns, addressed by document number
+        self.file_ids: List[str] = []
+        self.file_names: List[str] = []
+        self.file_sizes = array('q')
+        self.file_types = array('B')
+        self.years = array('H')      # 0 when unknown
+        self.seasons = array('B')    # 0 when unknown
+        self.qualities = array('B')  # index into quality_values, 0 when unknown
+        self.dates = array('d')      # epoch seconds, 0 when unknown
+        self.quality_values: List[Optional[str]] = [None]
+        self.doc_numbers: Dict[str, int] = {}
+        # Token numbers of every document back to back; document n owns
+        # doc_tokens[doc_token_ends[n - 1]:doc_token_ends[n]]
+        self.doc_tokens = array('I')
+        self.doc_token_ends = array('I')
+
+        # Vocabulary, postings and vocabulary trigrams
+        self.token_numbers: Dict[str, int] = {}
+        self.tokens: List[str] = []
+        self.postings: List[array] = []
+        self.trigram_postings: Dict[str, array] = {}
+        # Sorted vocabulary for prefix lookups, built on first use
+        self.sorted_tokens: Optional[List[str]] = None
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def __contains__(self, file_id: str) -> bool:
+        return file_id in self.doc_numbers
+
+    def _token_number(self, token: str) -> int:
+        number = self.token_numbers.get(token)
+        if number is None:
+            number = len(self.tokens)
+            self.token_numbers[token] = number
+            self.tokens.append(token)
+            self.postings.append(array('I'))
+            for gram in trigrams(token):
+                posting = self.trigram_postings.get(gram)
+                if posting is None:
+                    posting = self.trigram_postings[gram] = array('I')
+                posting.append(number)
+            if self.sorted_tokens is not None:
+                bisect.insort(self.sorted_tokens, token)
+        return number
+
+    def add(self, doc: Dict):
+        """Index a stored file; files already indexed are ignored"""
+        file_id = doc.get('file_id')
+        file_name = doc.get('file_name') or ""
+        if not file_id or file_id in self.doc_numbers:
+            return
+
+        number = len(self.file_ids)
+        self.doc_numbers[file_id] = number
+        self.file_ids.append(file_id)
+        self.file_names.append(file_name)
+        self.file_sizes.append(int(doc.get('file_size') or 0))
+        file_type = doc.get('file_type')
+        self.file_types.append(FILE_TYPES.index(file_type) if file_type in FILE_TYPES else 0)
+        self.years.append(doc.get('year') or 0)
+        self.seasons.append(min(doc.get('season') or 0, 255))
+        quality = doc.get('quality')
+        if quality not in self.quality_values:
+            self.quality_values.append(quality)
+        self.qualities.append(self.quality_values.index(quality))
+        self.dates.append(timestamp(doc.get('date')) or 0.0)
+
+        # Document numbers only grow, so every posting stays sorted
+        tokens = doc.get('tokens')
+        if tokens is None:
+            tokens = tokenize(file_name)
+        token_numbers = [self._token_number(token) for token in tokens]
+        for token_number in dict.fromkeys(token_numbers):
+            self.postings[token_number].append(number)
+        # Kept in order with repeats, so rankers count term frequencies
+        self.doc_tokens.extend(token_numbers)
+        self.doc_token_ends.append(len(self.doc_tokens))
+
+    def refresh(self, doc: Dict):
+        """Update the filter columns of an indexed file from its stored fields"""
+        number = self.doc_numbers.get(doc.get('file_id'))
+        if number is None:
+            return
+        self.years[number] = doc.get('year') or 0
+        self.seasons[number] = min(doc.get('season') or 0, 255)
+        quality = doc.get('quality')
+        if quality not in self.quality_values:
+            self.quality_values.append(quality)
+        self.qualities[number] = self.quality_values.index(quality)
+
+    def _idf(self, token_number: int) -> float:
+        return math.log(1 + len(self.file_ids) / (1 + len(self.postings[token_number])))
+
+    def _expand(self, token: str) -> List[tuple]:
+        """Known tokens matching a query word, with a similarity weight"""
+        number = self.token_numbers.get(token)
+        if number is not None:
+            return [(number, 1.0)]
+
+        grams = trigrams(token)
+        if not grams:
+            return []
+
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for candidate in self.trigram_postings.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        matches = []
+        for candidate, common in shared.items():
+            candidate_grams = max(len(self.tokens[candidate]) - 2, 1)
+            similarity = 2 * common / (len(grams) + candidate_grams)
+            if similarity >= self.fuzzy_threshold:
+                matches.append((similarity, candidate))
+
+        best = heapq.nlargest(self.fuzzy_expansions, matches)
+        return [(candidate, similarity) for similarity, candidate in best]
+
+    def _words(self, query: str) -> List[List[tuple]]:
+        """Expanded query words, rarest first"""
+        words = [self._expand(word) for word in dict.fromkeys(tokenize(query))]
+        words.sort(key=lambda expansions: sum(len(self.postings[n]) for n, _ in expansions))
+        return words
+
+    def _score(self, words: List[List[tuple]]) -> Dict[int, float]:
+        """Scores of every document matching the query words"""
+        scores: Dict[int, float] = {}
+
+        # Rarest words first, so common words only have to re-score the
+        # candidates the rare ones already found
+        for expansions in words:
+            weighted = [(self.postings[n], self._idf(n) * similarity) for n, similarity in expansions]
+            size = sum(len(posting) for posting, _ in weighted)
+
+            if scores and size > len(scores) * 8:
+                for doc in scores:
+                    best = 0.0
+                    for posting, weight in weighted:
+                        if weight > best:
+                            i = bisect.bisect_left(posting, doc)
+                            if i < len(posting) and posting[i] == doc:
+                                best = weight
+                    scores[doc] += best
+                continue
+
+            # A document scores a word once, through its best matching token
+            word_scores: Dict[int, float] = {}
+            for posting, weight in weighted:
+                for doc in posting:
+                    if word_scores.get(doc, 0.0) < weight:
+                        word_scores[doc] = weight
+            for doc, weight in word_scores.items():
+                scores[doc] = scores.get(doc, 0.0) + weight
+
+        return scores
+
+    def _filter(self, docs, filters: Optional[Dict]):
+        """Documents passing exact facet filters"""
+        if not filters:
+            return docs
+
+        checks = []
+        if 'file_type' in filters:
+            code = FILE_TYPES.index(filters['file_type']) if filters['file_type'] in FILE_TYPES else -1
+            checks.append((self.file_types, code))
+        if 'year' in filters:
+            checks.append((self.years, int(filters['year'])))
+        if 'season' in filters:
+            checks.append((self.seasons, int(filters['season'])))
+        if 'quality' in filters:
+            quality = filters['quality']
+            checks.append((self.qualities, self.quality_values.index(quality) if quality in self.quality_values else -1))
+
+        return [doc for doc in docs if all(column[doc] == value for column, value in checks)]
+
+    def search(self, query: str, filters: Dict = None, max_results: int = 50) -> List[Dict]:
+        """Top files for a query, scored by matched words weighted by rarity"""
+        words = self._words(query)
+
+        # One exactly matched word scores every hit the same: the whole
+        # posting competes on name length, as BM25 would, then on recency
+        if len(words) == 1 and len(words[0]) == 1 and not filters:
+            number, similarity = words[0][0]
+            score = self._idf(number) * similarity
+            top = heapq.nsmallest(max_results, self.postings[number], key=lambda doc: (self._length(doc), -doc))
+            return [self.get(doc, score) for doc in top]
+
+        scores = self._score(words)
+        docs = self._filter(scores, filters)
+        top = heapq.nlargest(max_results, docs, key=lambda doc: (scores[doc], -self._length(doc), doc))
+        return [self.get(doc, scores[doc]) for doc in top]
+
+    def _length(self, doc: int) -> int:
+        """Number of tokens in a document's name"""
+        return self.doc_token_ends[doc] - (self.doc_token_ends[doc - 1] if doc else 0)
+
+    def _prefix(self, prefix: str) -> List[tuple]:
+        """Most frequent known tokens starting with a partial word"""
+        if self.sorted_tokens is None:
+            self.sorted_tokens = sorted(self.tokens)
+        start = bisect.bisect_left(self.sorted_tokens, prefix)
+        end = bisect.bisect_left(self.sorted_tokens, prefix + "\uffff", start)
+        numbers = [self.token_numbers[token] for token in self.sorted_tokens[start:end]]
+        best = heapq.nlargest(self.prefix_expansions, numbers, key=lambda n: len(self.postings[n]))
+        return [(number, 1.0) for number in best]
+
+    @staticmethod
+    def _contains(postings: List[array], doc: int) -> bool:
+        for posting in postings:
+            i = bisect.bisect_left(posting, doc)
+            if i < len(posting) and posting[i] == doc:
+                return True
+        return False
+
+    def complete(self, query: str, offset: int = 0, limit: int = 20) -> List[Dict]:
+        """Newest files matching a query still being typed
+
+        Every word must match, the last one as a prefix. The rarest word's
+        postings are walked newest first and the others are probed by
+        bisection, so the walk stops as soon as a page is filled.
+        """
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return []
+
+        expanded = [self._expand(word) for word in words[:-1]]
+        expanded.append(self._prefix(words[-1]))
+        if not all(expanded):
+            return []
+
+        postings = [[self.postings[n] for n, _ in expansions] for expansions in expanded]
+        postings.sort(key=lambda group: sum(len(posting) for posting in group))
+        driver, others = postings[0], postings[1:]
+
+        found = []
+        last = None
+        for doc in heapq.merge(*(reversed(posting) for posting in driver), reverse=True):
+            if doc == last:
+                continue
+            last = doc
+            if all(self._contains(group, doc) for group in others):
+                found.append(doc)
+                if len(found) >= offset + limit:
+                    break
+
+        return [self.get(doc) for doc in found[offset:]]
+
+    def facets(self, query: str, filters: Dict = None) -> Dict[str, Dict]:
+        """Value counts per facet over every document matching the query"""
+        docs = self._filter(self._score(self._words(query)), filters)
+
+        counts = {'file_type': {}, 'year': {}, 'quality': {}, 'season': {}}
+        for doc in docs:
+            values = (
+                ('file_type', FILE_TYPES[self.file_types[doc]]),
+                ('year', self.years[doc] or None),
+                ('quality', self.quality_values[self.qualities[doc]]),
+                ('season', self.seasons[doc] or None)
+            )
+            for facet, value in values:
+                if value is not None:
+                    counts[facet][value] = counts[facet].get(value, 0) + 1
+        return counts
+
+    def get(self, doc: int, score: float = 0.0) -> Dict:
+        return {
+            'file_id': self.file_ids[doc],
+            'file_name': self.file_names[doc],
+            'file_size': self.file_sizes[doc],
+            'file_type': FILE_TYPES[self.file_types[doc]],
+            'year': self.years[doc] or None,
+            'quality': self.quality_values[self.qualities[doc]],
+            'season': self.seasons[doc] or None,
+            'date': self.dates[doc] or None,
+            'tokens': self.doc_token_list(doc),
+            'score': score
+        }
+
+    def doc_token_list(self, doc: int) -> List[str]:
+        start = self.doc_token_ends[doc - 1] if doc else 0
+        return [self.tokens[number] for number in self.doc_tokens[start:self.doc_token_ends[doc]]]
+
+    def find(self, file_id: str) -> Optional[Dict]:
+        doc = self.doc_numbers.get(file_id)
+        return None if doc is None else self.get(doc)
+
+    def stats(self) -> Dict:
+        return {
+            'files': len(self.file_ids),
+            'tokens': len(self.tokens),
+            'trigrams': len(self.trigram_postings),
+            'postings_bytes': sum(p.itemsize * len(p) for p in self.postings),
+            'doc_tokens_bytes': self.doc_tokens.itemsize * len(self.doc_tokens)
+        }
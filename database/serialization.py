@@ -0,0 +1,75 @@
+from typing import Dict, List, Optional
+
+import msgpack
+
+from database.ranking import timestamp
+
+# Bump when the packed layout changes; entries of another version are misses
+FORMAT_VERSION = 1
+
+# Fields a cached search keeps; the rest of the document stays in Mongo
+RESULT_FIELDS = ('file_id', 'file_name', 'file_size', 'file_type', 'year', 'quality', 'season', 'date', 'score')
+
+
+def pack_results(results: List[Dict]) -> bytes:
+    """Versioned msgpack of search results as rows of RESULT_FIELDS"""
+    rows = []
+    for doc in results:
+        row = [doc.get(field) for field in RESULT_FIELDS]
+        # Dates travel as epoch seconds, readable by every instance
+        row[RESULT_FIELDS.index('date')] = timestamp(doc.get('date'))
+        rows.append(row)
+    return bytes([FORMAT_VERSION]) + msgpack.packb(rows, use_bin_type=True)
+
+
+def unpack_results(data: bytes) -> Optional[List[Dict]]:
+    """Search results from pack_results, or None for another format version"""
+    if not data or data[0] != FORMAT_VERSION:
+        return None
+    rows = msgpack.unpackb(data[1:], raw=False)
+    return [dict(zip(RESULT_FIELDS, row)) for row in rows]
+
+
+# Fields a cached file detail keeps; enough to send or describe the file
+DETAIL_FIELDS = ('file_id', 'file_ref', 'file_name', 'file_size', 'file_type', 'mime_type', 'caption',
+                 'chat_id', 'message_id', 'date')
+
+
+def pack_document(doc: Dict) -> bytes:
+    """Versioned msgpack of a stored file's DETAIL_FIELDS"""
+    row = [doc.get(field) for field in DETAIL_FIELDS]
+    row[DETAIL_FIELDS.index('date')] = timestamp(doc.get('date'))
+    return bytes([FORMAT_VERSION]) + msgpack.packb(row, use_bin_type=True)
+
+
+def unpack_document(data: bytes) -> Optional[Dict]:
+    """A file detail from pack_document, or None for another format version"""
+    if not data or data[0] != FORMAT_VERSION:
+        return None
+    return dict(zip(DETAIL_FIELDS, msgpack.unpackb(data[1:], raw=False)))
+
+
+# Fields another instance needs to add a new file to its memory structures
+INDEX_FIELDS = ('file_id', 'file_name', 'file_size', 'file_type', 'tokens', 'year', 'quality', 'season', 'date')
+
+
+def index_rows(docs: List[Dict]) -> List[list]:
+    """New files as rows of INDEX_FIELDS, to publish with an invalidation"""
+    rows = []
+    for doc in docs:
+        row = [doc.get(field) for field in INDEX_FIELDS]
+        row[INDEX_FIELDS.index('date')] = timestamp(doc.get('date'))
+        rows.append(row)
+    return rows
+
+
+def index_documents(rows: List[list]) -> List[Dict]:
+    return [dict(zip(INDEX_FIELDS, row)) for row in rows]
+
+
+def pack_message(payload: Dict) -> bytes:
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def unpack_message(data: bytes) -> Dict:
+    return msgpack.unpackb(data, raw=False)
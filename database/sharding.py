@@ -0,0 +1,66 @@
+import bisect
+import hashlib
+from typing import Hashable, Iterator, List
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to shard ids"""
+
+    def __init__(self, nodes=(), replicas: int = 160):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: List[Hashable] = []
+        self.nodes = set()
+
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        """Stable 64-bit hash, identical across processes and restarts"""
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def add_node(self, node: Hashable):
+        """Add a node with its virtual points"""
+        if node in self.nodes:
+            return
+
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}:{replica}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node: Hashable):
+        """Remove a node and all of its virtual points"""
+        if node not in self.nodes:
+            return
+
+        self.nodes.discard(node)
+        kept = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def get_node(self, key: str):
+        """Return the owning node for a key"""
+        if not self._points:
+            return None
+
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[index]
+
+    def get_nodes(self, key: str) -> Iterator:
+        """Yield distinct nodes in ring order starting at the owner"""
+        if not self._points:
+            return
+
+        start = bisect.bisect(self._points, self._hash(key))
+        seen = set()
+        for offset in range(len(self._points)):
+            node = self._owners[(start + offset) % len(self._points)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
@@ -0,0 +1,37 @@
+import asyncio
+from typing import Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one in-flight call"""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.flights = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        """Run fn for key, or join the call already running for it"""
+        task = self._calls.get(key)
+
+        if task is None:
+            self.flights += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+
+        # Shield so one caller giving up does not cancel the shared call
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception retrieved even if every waiter went away
+            task.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
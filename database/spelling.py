@@ -0,0 +1,131 @@
+import sys
+from typing import Dict, List, Optional, Set
+
+from database.normalize import tokenize
+
+_LIST_OVERHEAD = sys.getsizeof([])
+_POINTER_SIZE = 8
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance, or max_distance + 1 if larger"""
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+
+    return previous[-1]
+
+
+class SymSpell:
+    """Symmetric delete spelling index over the filename vocabulary"""
+
+    def __init__(self, max_edit_distance: int = 2, prefix_length: int = 7,
+                 max_words: int = 100000, max_bytes: int = 128 << 20,
+                 min_length: int = 3, max_length: int = 24):
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+        self.max_words = max_words
+        self.max_bytes = max_bytes
+        self.min_length = min_length
+        self.max_length = max_length
+
+        self.words: Dict[str, int] = {}
+        self.deletes: Dict[str, List[str]] = {}
+        self.bytes = sys.getsizeof(self.words) + sys.getsizeof(self.deletes)
+
+    def _edits(self, word: str) -> Set[str]:
+        """All strings within max_edit_distance deletes of the word prefix"""
+        prefix = word[:self.prefix_length]
+        edits = {prefix}
+        frontier = {prefix}
+        for _ in range(self.max_edit_distance):
+            next_frontier = set()
+            for item in frontier:
+                if len(item) <= 1:
+                    continue
+                for i in range(len(item)):
+                    next_frontier.add(item[:i] + item[i + 1:])
+            next_frontier -= edits
+            edits |= next_frontier
+            frontier = next_frontier
+        return edits
+
+    def add_word(self, word: str, count: int = 1):
+        """Add a token or bump its frequency"""
+        if not self.min_length <= len(word) <= self.max_length or word.isdigit():
+            return
+
+        if word in self.words:
+            self.words[word] += count
+            return
+        if len(self.words) >= self.max_words or self.bytes >= self.max_bytes:
+            return
+
+        self.words[word] = count
+        self.bytes += sys.getsizeof(word) + _POINTER_SIZE * 2
+        for edit in self._edits(word):
+            bucket = self.deletes.get(edit)
+            if bucket is None:
+                self.deletes[edit] = [word]
+                self.bytes += sys.getsizeof(edit) + _LIST_OVERHEAD + _POINTER_SIZE * 3
+            else:
+                bucket.append(word)
+                self.bytes += _POINTER_SIZE
+
+    def add_text(self, text: str):
+        """Add every token of a filename"""
+        for token in tokenize(text):
+            self.add_word(token)
+
+    def lookup(self, word: str) -> Optional[str]:
+        """Closest known word by edit distance, then frequency"""
+        if word in self.words:
+            return word
+        if not self.min_length <= len(word) <= self.max_length or word.isdigit():
+            return None
+
+        best = None
+        best_distance = self.max_edit_distance + 1
+        best_count = 0
+        seen = set()
+        for edit in self._edits(word):
+            for candidate in self.deletes.get(edit, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(word, candidate, min(best_distance, self.max_edit_distance))
+                count = self.words[candidate]
+                if distance < best_distance or (distance == best_distance and count > best_count):
+                    best, best_distance, best_count = candidate, distance, count
+
+        return best if best_distance <= self.max_edit_distance else None
+
+    def correct(self, query: str) -> str:
+        """Correct each word of a query, keeping words with no suggestion"""
+        words = query.split()
+        return " ".join(self.lookup(word.lower()) or word for word in words)
+
+    def stats(self) -> Dict:
+        return {
+            'words': len(self.words),
+            'deletes': len(self.deletes),
+            'bytes': self.bytes
+        }
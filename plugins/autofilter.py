@@ -6,12 +6,16 @@ from pyrogram.errors.exceptions.bad_request_400 import MediaEmpty, PhotoInvalidD
 from script import Script
 import pyrogram
 from database.database import db
+from database.normalize import STOP_WORDS
 from pyrogram import Client, filters, enums
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from utils import get_search_results, get_file_details, is_subscribed, get_poster
+from pyrogram.types import InputMediaDocument, InputMediaVideo, InputMediaAudio, InputMediaPhoto
+from pyrogram.file_id import FileType
+from utils import get_search_results, get_file_details, is_subscribed, get_poster, get_movie_info, result_sessions, ResultSession
+from utils import admission, AdmissionController, outbound, OutboundScheduler, file_kind
 from config import Config
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 import time
 
 logger = logging.getLogger(__name__)
@@ -31,10 +35,6 @@ async def auto_filter(bot, message):
     if message.text.startswith(('/', '@', '#')):
         return
     
-    # Check if user is subscribed (if auth channel is set)
-    if Config.AUTH_CHANNEL and not await is_subscribed(bot, message):
-        return
-    
     # Extract search query
     search_query = message.text.strip()
     
@@ -44,17 +44,42 @@ async def auto_filter(bot, message):
     if len(search_query) < 2:
         return
     
+    # Chatter with no word from any stored file name never reaches the
+    # databases; a spelling fix may still turn it into a searchable query,
+    # which is then searched instead of the original
+    matched_query = search_query
+    corrected_query = None
+    if not db.may_match(search_query):
+        if not Config.SPELL_CHECK:
+            return
+        corrected_query = await spell_check(search_query)
+        if corrected_query == search_query or not db.may_match(corrected_query):
+            return
+        matched_query = corrected_query
+    
+    # Per-user, per-chat and global budgets; over budget, drop silently
+    user_id = message.from_user.id if message.from_user else None
+    if not await admission.admit(user_id, message.chat.id, search_priority(message)):
+        return
+    
+    # Check if user is subscribed (if auth channel is set)
+    if Config.AUTH_CHANNEL and not await is_subscribed(bot, message):
+        return
+    
     # Show typing indicator
     await bot.send_chat_action(message.chat.id, enums.ChatAction.TYPING)
     
+    # Start the IMDb lookup alongside the file search
+    movie_task = asyncio.create_task(get_movie_info(matched_query)) if Config.IMDB else None
+    
     try:
         # Fast search with caching
         files = await db.get_search_results(
-            query=search_query,
+            query=matched_query,
             max_results=Config.MAX_RESULTS
         )
         
-        if not files:
+        if not files and corrected_query is None:
             # Try spell check if enabled
             if Config.SPELL_CHECK:
                 corrected_query = await spell_check(search_query)
@@ -63,15 +88,17 @@ async def auto_filter(bot, message):
                         query=corrected_query,
                         max_results=Config.MAX_RESULTS
                     )
+                    matched_query = corrected_query
         
         if files:
-            # Create pagination buttons
-            btn = await create_pagination_buttons(files, search_query, 0)
+            # Keep the hits server-side so page flips need no new search
+            session = result_sessions.create(matched_query, files)
+            btn = await create_pagination_buttons(session, 0)
             
-            # Get movie info if IMDB is enabled
+            # Get movie info if IMDB is enabled; empty if it ran over budget
             movie_info = ""
-            if Config.IMDB:
-                movie_info = await get_movie_info(search_query)
+            if movie_task:
+                movie_info = await movie_task
             
             # Create response message
             file_count = len(files)
@@ -82,27 +109,31 @@ async def auto_filter(bot, message):
             
             response_text += f"<b>📁 Select a file to download:</b>"
             
-            # Send response
-            await message.reply_text(
+            # Send response; queued behind the chat's pacing, not awaited
+            outbound.submit(message.chat.id, lambda: message.reply_text(
                 text=response_text,
                 reply_markup=InlineKeyboardMarkup(btn),
                 parse_mode=enums.ParseMode.HTML
-            )
+            ))
             
         else:
             # No results found
-            await message.reply_text(
+            outbound.submit(message.chat.id, lambda: message.reply_text(
                 f"<b>❌ No results found for:</b> <code>{search_query}</code>\n\n"
                 f"<b>💡 Try:</b>\n"
                 f"• Different keywords\n"
                 f"• Check spelling\n"
                 f"• Use movie/series name only",
                 parse_mode=enums.ParseMode.HTML
-            )
+            ))
     
     except Exception as e:
         logger.error(f"Auto filter error: {e}")
-        await message.reply_text("❌ An error occurred while searching. Please try again.")
+        outbound.submit(message.chat.id, lambda: message.reply_text("❌ An error occurred while searching. Please try again."))
+    
+    finally:
+        if movie_task and not movie_task.done():
+            movie_task.cancel()
     
     # Log performance
     end_time = time.time()
@@ -111,46 +142,123 @@ async def auto_filter(bot, message):
 @Client.on_callback_query(filters.regex(r"^next_"))
 async def next_page(bot, query: CallbackQuery):
     """Handle pagination - next page"""
+    await change_page(query)
+
+@Client.on_callback_query(filters.regex(r"^prev_"))
+async def prev_page(bot, query: CallbackQuery):
+    """Handle pagination - previous page"""
+    await change_page(query)
+
+async def change_page(query: CallbackQuery):
+    """Render a page of a stored result session"""
     try:
-        _, search_query, offset = query.data.split("_", 2)
+        token, offset = query.data.split("_", 1)[1].rsplit(":", 1)
         offset = int(offset)
         
-        files = await db.get_search_results(
-            query=search_query,
-            max_results=Config.MAX_RESULTS
-        )
+        session = result_sessions.get(token)
+        if not session:
+            await query.answer("⌛ This search has expired, please search again", show_alert=True)
+            return
         
-        btn = await create_pagination_buttons(files, search_query, offset)
+        btn = await create_pagination_buttons(session, offset)
+        if not btn:
+            await query.answer("📭 No more results", show_alert=False)
+            return
         
-        await query.edit_message_reply_markup(
-            reply_markup=InlineKeyboardMarkup(btn)
-        )
+        await edit_markup(query, btn)
         
     except Exception as e:
         logger.error(f"Pagination error: {e}")
         await query.answer("❌ Error loading page", show_alert=True)
 
-@Client.on_callback_query(filters.regex(r"^prev_"))
-async def prev_page(bot, query: CallbackQuery):
-    """Handle pagination - previous page"""
+@Client.on_callback_query(filters.regex(r"^page_"))
+async def first_page(bot, query: CallbackQuery):
+    """Handle return to a result list from the filter menu"""
+    await change_page(query)
+
+@Client.on_callback_query(filters.regex(r"^filters_"))
+async def filter_menu(bot, query: CallbackQuery):
+    """Show filter values with their counts"""
     try:
-        _, search_query, offset = query.data.split("_", 2)
-        offset = int(offset)
+        token = query.data.split("_", 1)[1]
+        session = result_sessions.get(token)
+        if not session:
+            await query.answer("⌛ This search has expired, please search again", show_alert=True)
+            return
         
-        files = await db.get_search_results(
-            query=search_query,
-            max_results=Config.MAX_RESULTS
-        )
+        # One facet aggregation per shard covers every filter button
+        if session.facets is None:
+            session.facets = await db.get_facets(session.query, session.filters)
         
-        btn = await create_pagination_buttons(files, search_query, offset)
+        btn = []
+        for facet, label in FILTER_LABELS.items():
+            if facet in session.filters:
+                continue
+            values = session.facets.get(facet, [])
+            if len(values) < 2:
+                continue
+            row = []
+            for value, count in values:
+                row.append(InlineKeyboardButton(
+                    f"{label}{value} ({count})",
+                    callback_data=f"fset_{token}:{facet}:{value}"
+                ))
+                if len(row) == 3:
+                    btn.append(row)
+                    row = []
+            if row:
+                btn.append(row)
         
-        await query.edit_message_reply_markup(
-            reply_markup=InlineKeyboardMarkup(btn)
-        )
+        if not btn:
+            await query.answer("No more filters for these results", show_alert=False)
+            return
         
+        btn.append([InlineKeyboardButton("🔙 Back", callback_data=f"page_{token}:0")])
+        await edit_markup(query, btn)
+    
     except Exception as e:
-        logger.error(f"Pagination error: {e}")
-        await query.answer("❌ Error loading page", show_alert=True)
+        logger.error(f"Filter menu error: {e}")
+        await query.answer("❌ Error loading filters", show_alert=True)
+
+@Client.on_callback_query(filters.regex(r"^fset_"))
+async def apply_filter(bot, query: CallbackQuery):
+    """Narrow a result session by one filter value"""
+    try:
+        token, facet, value = query.data.split("_", 1)[1].split(":", 2)
+        session = result_sessions.get(token)
+        if not session or facet not in FILTER_LABELS:
+            await query.answer("⌛ This search has expired, please search again", show_alert=True)
+            return
+        
+        if facet in ('year', 'season'):
+            value = int(value)
+        active = dict(session.filters, **{facet: value})
+        
+        # Narrow the cached hits; only search again if the full result set
+        # holds more matches than the capped hits could contain
+        files = [hit for hit in session.hits if all(hit.get(k) == v for k, v in active.items())]
+        expected = dict(session.facets or {}).get(facet, [])
+        expected = next((count for v, count in expected if v == value), len(files))
+        if len(files) < min(expected, Config.MAX_RESULTS):
+            files = await db.get_search_results(
+                query=session.query,
+                max_results=Config.MAX_RESULTS,
+                filters=active
+            )
+        
+        if not files:
+            await query.answer("❌ No files match this filter", show_alert=True)
+            return
+        
+        filtered = result_sessions.create(session.query, files, filters=active, base=session.base or session)
+        btn = await create_pagination_buttons(filtered, 0)
+        
+        await edit_markup(query, btn)
+        await query.answer(f"✅ {len(files)} files", show_alert=False)
+    
+    except Exception as e:
+        logger.error(f"Filter error: {e}")
+        await query.answer("❌ Error applying filter", show_alert=True)
 
 @Client.on_callback_query(filters.regex(r"^file_"))
 async def send_file(bot, query: CallbackQuery):
@@ -165,20 +273,20 @@ async def send_file(bot, query: CallbackQuery):
             return
         
         # Check if user is subscribed
-        if Config.AUTH_CHANNEL and not await is_subscribed(bot, query):
+        if Config.AUTH_CHANNEL and not await is_subscribed(bot, query, trust_negative=False):
             await query.answer("❌ Please join our channel first", show_alert=True)
             return
         
         # Send file
         try:
-            await bot.send_cached_media(
+            await outbound.send(query.from_user.id, lambda: bot.send_cached_media(
                 chat_id=query.from_user.id,
                 file_id=file_details['file_id'],
                 caption=f"<b>📁 {file_details['file_name']}</b>\n\n"
                        f"<b>📊 Size:</b> {get_size(file_details['file_size'])}\n"
                        f"<b>🎬 Requested by:</b> {query.from_user.mention}",
                 parse_mode=enums.ParseMode.HTML
-            )
+            ), OutboundScheduler.DELIVERY)
             
             await query.answer("✅ File sent to your PM", show_alert=False)
             
@@ -190,9 +298,132 @@ async def send_file(bot, query: CallbackQuery):
         logger.error(f"File callback error: {e}")
         await query.answer("❌ An error occurred", show_alert=True)
 
-async def create_pagination_buttons(files: List[Dict], search_query: str, offset: int) -> List[List[InlineKeyboardButton]]:
-    """Create optimized pagination buttons"""
+# Files sharing a key can go in one media group; other types go one by one.
+# Keyed by the file id's real type, which media groups check
+MEDIA_GROUPS = {
+    FileType.DOCUMENT: ('document', InputMediaDocument),
+    FileType.VIDEO: ('visual', InputMediaVideo),
+    FileType.PHOTO: ('visual', InputMediaPhoto),
+    FileType.AUDIO: ('audio', InputMediaAudio)
+}
+MEDIA_GROUP_SIZE = 10
+
+# user id -> "Send all" deliveries in progress
+active_deliveries: Dict[int, int] = {}
+
+@Client.on_callback_query(filters.regex(r"^sendall_"))
+async def send_all(bot, query: CallbackQuery):
+    """Send every file on a result page in as few messages as possible"""
+    user_id = query.from_user.id
+    try:
+        token, offset = query.data.split("_", 1)[1].rsplit(":", 1)
+        session = result_sessions.get(token)
+        page = session.pages.get(int(offset)) if session else None
+        if not page:
+            await query.answer("⌛ This search has expired, please search again", show_alert=True)
+            return
+        
+        if Config.AUTH_CHANNEL and not await is_subscribed(bot, query, trust_negative=False):
+            await query.answer("❌ Please join our channel first", show_alert=True)
+            return
+        
+        if active_deliveries.get(user_id, 0) >= Config.SEND_ALL_PER_USER:
+            await query.answer("⏳ Your previous files are still being sent", show_alert=True)
+            return
+        
+        # The rendered page holds the file ids, deep pages included
+        file_ids = [
+            button.callback_data.split("_", 1)[1]
+            for row in page for button in row
+            if button.callback_data and button.callback_data.startswith("file_")
+        ]
+        
+        active_deliveries[user_id] = active_deliveries.get(user_id, 0) + 1
+        try:
+            details = await db.get_files_details(file_ids)
+            files = [details[file_id] for file_id in file_ids if file_id in details]
+            if not files:
+                await query.answer("❌ File not found", show_alert=True)
+                return
+            
+            await query.answer(f"📤 Sending {len(files)} files to your PM", show_alert=False)
+            sent = await deliver_files(bot, user_id, files, query.from_user.mention)
+        finally:
+            active_deliveries[user_id] -= 1
+            if not active_deliveries[user_id]:
+                del active_deliveries[user_id]
+        
+        if sent < len(files):
+            outbound.submit(user_id, lambda: bot.send_message(
+                user_id, f"⚠️ {len(files) - sent} of {len(files)} files could not be sent"
+            ), OutboundScheduler.DELIVERY)
+    
+    except Exception as e:
+        logger.error(f"Send all error: {e}")
+        await query.answer("❌ An error occurred", show_alert=True)
+
+async def deliver_files(bot, chat_id: int, files: List[Dict], mention: str) -> int:
+    """Send files as media groups of up to ten, returning how many arrived"""
+    groups: Dict[str, List] = {}
+    singles = []
+    for file_doc in files:
+        caption = (f"<b>📁 {file_doc['file_name']}</b>\n\n"
+                   f"<b>📊 Size:</b> {get_size(file_doc['file_size'])}\n"
+                   f"<b>🎬 Requested by:</b> {mention}")
+        group = MEDIA_GROUPS.get(file_kind(file_doc['file_id']))
+        if group:
+            key, media_type = group
+            groups.setdefault(key, []).append(
+                media_type(file_doc['file_id'], caption=caption, parse_mode=enums.ParseMode.HTML)
+            )
+        else:
+            singles.append((file_doc['file_id'], caption))
+    
+    sends = []
+    for media in groups.values():
+        for i in range(0, len(media), MEDIA_GROUP_SIZE):
+            chunk = media[i:i + MEDIA_GROUP_SIZE]
+            if len(chunk) == 1:
+                # A media group needs at least two items
+                sends.append((lambda item=chunk[0]: bot.send_cached_media(
+                    chat_id, item.media, caption=item.caption, parse_mode=enums.ParseMode.HTML
+                ), 1))
+            else:
+                sends.append((lambda chunk=chunk: bot.send_media_group(chat_id, chunk), len(chunk)))
+    for file_id, caption in singles:
+        sends.append((lambda file_id=file_id, caption=caption: bot.send_cached_media(
+            chat_id, file_id, caption=caption, parse_mode=enums.ParseMode.HTML
+        ), 1))
+    
+    results = await asyncio.gather(
+        *[outbound.send(chat_id, call, OutboundScheduler.DELIVERY) for call, _ in sends],
+        return_exceptions=True
+    )
+    sent = 0
+    for (_, count), result in zip(sends, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error sending files: {result}")
+        else:
+            sent += count
+    return sent
+
+async def edit_markup(query: CallbackQuery, btn: List[List[InlineKeyboardButton]]):
+    """Queue a swap of a result message's keyboard; rapid flips collapse into the last one"""
+    message = query.message
+    outbound.submit(
+        message.chat.id,
+        lambda: query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(btn)),
+        key=f"markup:{message.chat.id}:{message.id}"
+    )
+
+async def create_pagination_buttons(session: ResultSession, offset: int) -> Optional[List[List[InlineKeyboardButton]]]:
+    """Create optimized pagination buttons, or None past the last result"""
+    # Pages are rendered once per session and reused on every flip
+    if offset in session.pages:
+        return session.pages[offset]
+    
     btn = []
+    files = session.hits
     
     # Calculate pagination
     total_files = len(files)
@@ -200,10 +431,33 @@ async def create_pagination_buttons(files: List[Dict], search_query: str, offset
     total_pages = math.ceil(total_files / files_per_page)
     current_page = offset // files_per_page + 1
     
-    # Get files for current page
-    start_idx = offset
-    end_idx = min(offset + files_per_page, total_files)
-    page_files = files[start_idx:end_idx]
+    if offset < total_files:
+        # Get files for current page
+        start_idx = offset
+        end_idx = min(offset + files_per_page, total_files)
+        page_files = files[start_idx:end_idx]
+        has_next = current_page < total_pages or session.capped
+    else:
+        # Past the capped hits: fetch the page lazily from the shards,
+        # resuming from the keyset cursor the previous deep page left
+        deep_page = (offset - total_pages * files_per_page) // files_per_page
+        if deep_page not in session.cursors:
+            return None
+        page_files, next_cursor = await db.get_search_page(
+            session.query,
+            cursor=session.cursors[deep_page],
+            page_size=files_per_page,
+            filters=session.filters,
+            skip_ids={hit['file_id'] for hit in files}
+        )
+        if not page_files:
+            return None
+        has_next = next_cursor is not None
+        if has_next:
+            session.cursors[deep_page + 1] = next_cursor
+    
+    # Details for this page are likely to be clicked next
+    db.prefetch_details([file_doc['file_id'] for file_doc in page_files])
     
     # Create file buttons
     for file_doc in page_files:
@@ -222,37 +476,66 @@ async def create_pagination_buttons(files: List[Dict], search_query: str, offset
         ])
     
     # Add pagination controls
-    if total_pages > 1:
+    if current_page > 1 or has_next:
         nav_buttons = []
         
         # Previous button
         if current_page > 1:
             prev_offset = max(0, offset - files_per_page)
             nav_buttons.append(
-                InlineKeyboardButton("⬅️ Previous", callback_data=f"prev_{search_query}_{prev_offset}")
+                InlineKeyboardButton("⬅️ Previous", callback_data=f"prev_{session.token}:{prev_offset}")
             )
         
-        # Page info
+        # Page info; "+" when more results exist beyond the capped list
         nav_buttons.append(
-            InlineKeyboardButton(f"📄 {current_page}/{total_pages}", callback_data="pages")
+            InlineKeyboardButton(
+                f"📄 {current_page}/{total_pages}{'+' if session.capped else ''}",
+                callback_data="pages"
+            )
         )
         
         # Next button
-        if current_page < total_pages:
+        if has_next:
             next_offset = offset + files_per_page
             nav_buttons.append(
-                InlineKeyboardButton("Next ➡️", callback_data=f"next_{search_query}_{next_offset}")
+                InlineKeyboardButton("Next ➡️", callback_data=f"next_{session.token}:{next_offset}")
             )
         
         btn.append(nav_buttons)
     
+    # Filter controls and delivery of the whole page
+    filter_buttons = [
+        InlineKeyboardButton("📤 Send all", callback_data=f"sendall_{session.token}:{offset}"),
+        InlineKeyboardButton("🔎 Filter", callback_data=f"filters_{session.token}")
+    ]
+    if session.filters:
+        active = ", ".join(str(value) for value in session.filters.values())
+        filter_buttons.append(
+            InlineKeyboardButton(f"❌ {active}", callback_data=f"page_{session.base.token}:0")
+        )
+    btn.append(filter_buttons)
+    
+    session.pages[offset] = btn
     return btn
 
+FILTER_LABELS = {
+    'quality': "🎞 ",
+    'season': "📺 S",
+    'year': "📅 ",
+    'file_type': "📁 "
+}
+
+def search_priority(message) -> int:
+    """Admins and replies to the bot keep their searches when load is shed"""
+    if message.from_user and message.from_user.id in Config.AUTH_USERS:
+        return AdmissionController.HIGH
+    reply = message.reply_to_message
+    if reply and reply.from_user and reply.from_user.is_self:
+        return AdmissionController.HIGH
+    return AdmissionController.LOW
+
 def clean_search_query(query: str) -> str:
     """Clean and optimize search query"""
-    # Remove common words
-    stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were'}
-    
     # Clean special characters but keep spaces and alphanumeric
     query = re.sub(r'[^\w\s]', ' ', query)
     
@@ -260,59 +543,13 @@ def clean_search_query(query: str) -> str:
     words = query.lower().split()
     
     # Filter out stop words and short words
-    filtered_words = [word for word in words if word not in stop_words and len(word) > 1]
+    filtered_words = [word for word in words if word not in STOP_WORDS and len(word) > 1]
     
     return ' '.join(filtered_words)
 
 async def spell_check(query: str) -> str:
-    """Simple spell check for common movie terms"""
-    # This is a basic implementation - you can integrate with a proper spell checker
-    corrections = {
-        'moive': 'movie',
-        'flim': 'film',
-        'seson': 'season',
-        'epsiode': 'episode',
-        'documentry': 'documentary'
-    }
-    
-    words = query.split()
-    corrected_words = []
-    
-    for word in words:
-        corrected_words.append(corrections.get(word.lower(), word))
-    
-    return ' '.join(corrected_words)
-
-async def get_movie_info(query: str) -> str:
-    """Get movie information from IMDB"""
-    try:
-        from imdb import IMDb
-        
-        ia = IMDb()
-        movies = ia.search_movie(query)
-        
-        if movies:
-            movie = movies[0]
-            ia.update(movie)
-            
-            title = movie.get('title', 'N/A')
-            year = movie.get('year', 'N/A')
-            rating = movie.get('rating', 'N/A')
-            genres = ', '.join(movie.get('genres', [])[:3])
-            plot = movie.get('plot outline', 'N/A')
-            
-            if len(plot) > 200:
-                plot = plot[:197] + "..."
-            
-            return (f"<b>🎬 {title} ({year})</b>\n"
-                   f"<b>⭐ Rating:</b> {rating}/10\n"
-                   f"<b>🎭 Genre:</b> {genres}\n"
-                   f"<b>📝 Plot:</b> {plot}")
-    
-    except Exception as e:
-        logger.error(f"IMDB error: {e}")
-    
-    return ""
+    """Correct misspelled words against the indexed filename vocabulary"""
+    return db.speller.correct(query)
 
 def get_size(size_bytes: int) -> str:
     """Convert bytes to human readable format"""
@@ -2,9 +2,11 @@ import logging
 import asyncio
 from pyrogram import Client, filters, enums
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.errors import FloodWait, UserIsBlocked, ChatAdminRequired, PeerIdInvalid
+from pyrogram.errors import UserIsBlocked, ChatAdminRequired, PeerIdInvalid, FloodWait
 from database.database import db
 from config import Config
+from utils import refresh_title_index, admission, outbound, OutboundScheduler
+from typing import Dict
 import time
 
 logger = logging.getLogger(__name__)
@@ -43,32 +45,22 @@ async def index_files(bot, message):
     )
     
     start_time = time.time()
-    total_files = 0
-    duplicate_files = 0
-    errors = 0
+    counts = {'saved': 0, 'duplicates': 0, 'errors': 0}
+    queued = 0
+    
+    # Producer/consumer pipeline: history fetch feeds a bounded queue,
+    # writer tasks drain it in BATCH_SIZE chunks
+    queue = asyncio.Queue(maxsize=Config.INDEX_QUEUE_SIZE)
+    writers = [
+        asyncio.create_task(index_writer(queue, counts))
+        for _ in range(max(1, Config.INDEX_WORKERS))
+    ]
     
     try:
         # Get all messages from channel
-        async for message_obj in bot.get_chat_history(channel_id):
+        async for message_obj in chat_history(bot, channel_id):
             try:
-                # Process media files
-                media = None
-                if message_obj.document:
-                    media = message_obj.document
-                elif message_obj.video:
-                    media = message_obj.video
-                elif message_obj.audio:
-                    media = message_obj.audio
-                elif message_obj.photo:
-                    media = message_obj.photo
-                elif message_obj.animation:
-                    media = message_obj.animation
-                elif message_obj.voice:
-                    media = message_obj.voice
-                elif message_obj.video_note:
-                    media = message_obj.video_note
-                elif message_obj.sticker:
-                    media = message_obj.sticker
+                media = get_media(message_obj)
                 
                 if media:
                     # Add additional attributes for database
@@ -77,52 +69,183 @@ async def index_files(bot, message):
                     media.date = message_obj.date
                     media.file_type = get_file_type(media)
                     
-                    # Save to database
-                    if await db.save_file(media):
-                        total_files += 1
-                    else:
-                        duplicate_files += 1
+                    await queue.put(media)
+                    queued += 1
                     
-                    # Update progress every 100 files
-                    if (total_files + duplicate_files) % 100 == 0:
-                        try:
-                            await msg.edit_text(
-                                f"<b>🔄 Indexing in progress...</b>\n\n"
-                                f"<b>📺 Channel:</b> {channel_title}\n"
-                                f"<b>✅ Indexed:</b> {total_files}\n"
-                                f"<b>🔄 Duplicates:</b> {duplicate_files}\n"
-                                f"<b>⏱️ Time:</b> {time.time() - start_time:.1f}s",
-                                parse_mode=enums.ParseMode.HTML
-                            )
-                        except FloodWait as e:
-                            await asyncio.sleep(e.value)
-                        except Exception:
-                            pass
+                    # Update progress every batch; queued, so a FloodWait
+                    # never stalls the history fetch
+                    if queued % Config.BATCH_SIZE == 0:
+                        progress_edit(
+                            msg,
+                            f"<b>🔄 Indexing in progress...</b>\n\n"
+                            f"<b>📺 Channel:</b> {channel_title}\n"
+                            f"<b>✅ Indexed:</b> {counts['saved']}\n"
+                            f"<b>🔄 Duplicates:</b> {counts['duplicates']}\n"
+                            f"<b>⏱️ Time:</b> {time.time() - start_time:.1f}s"
+                        )
             
             except Exception as e:
-                errors += 1
+                counts['errors'] += 1
                 logger.error(f"Error processing message: {e}")
                 continue
     
     except Exception as e:
         logger.error(f"Error during indexing: {e}")
-        return await msg.edit_text(f"❌ Indexing failed: {e}")
+        for writer in writers:
+            writer.cancel()
+        return await progress_edit(msg, f"❌ Indexing failed: {e}")
+    
+    # Signal writers to flush and stop
+    for _ in writers:
+        await queue.put(None)
+    await asyncio.gather(*writers)
     
     # Final results
     end_time = time.time()
     duration = end_time - start_time
     
-    await msg.edit_text(
+    await progress_edit(
+        msg,
         f"<b>✅ Indexing completed!</b>\n\n"
         f"<b>📺 Channel:</b> {channel_title}\n"
-        f"<b>✅ New files:</b> {total_files}\n"
-        f"<b>🔄 Duplicates:</b> {duplicate_files}\n"
-        f"<b>❌ Errors:</b> {errors}\n"
+        f"<b>✅ New files:</b> {counts['saved']}\n"
+        f"<b>🔄 Duplicates:</b> {counts['duplicates']}\n"
+        f"<b>❌ Errors:</b> {counts['errors']}\n"
         f"<b>⏱️ Duration:</b> {duration:.1f}s\n"
-        f"<b>⚡ Speed:</b> {(total_files + duplicate_files) / duration:.1f} files/sec",
-        parse_mode=enums.ParseMode.HTML
+        f"<b>⚡ Speed:</b> {(counts['saved'] + counts['duplicates']) / duration:.1f} files/sec"
+    )
+
+async def index_writer(queue: asyncio.Queue, counts: Dict[str, int]):
+    """Drain the indexing queue and bulk save files in batches"""
+    done = False
+    
+    while not done:
+        batch = []
+        item = await queue.get()
+        
+        # Take whatever is already queued, up to one batch
+        while True:
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+            if len(batch) >= Config.BATCH_SIZE:
+                break
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+        
+        if not batch:
+            continue
+        
+        try:
+            result = await db.save_files(batch)
+        except Exception as e:
+            logger.error(f"Error writing index batch: {e}")
+            result = {'saved': 0, 'duplicates': 0, 'errors': len(batch)}
+        
+        for key, value in result.items():
+            counts[key] += value
+
+@Client.on_message(filters.command('rebalance') & filters.user(Config.AUTH_USERS))
+async def rebalance_files(bot, message):
+    """Move existing files to their hash owner database"""
+    
+    msg = await message.reply_text("🔄 Rebalancing databases...")
+    start_time = time.time()
+    last_update = start_time
+    
+    async def progress(counts):
+        nonlocal last_update
+        if time.time() - last_update < 10:
+            return
+        last_update = time.time()
+        progress_edit(
+            msg,
+            f"<b>🔄 Rebalancing in progress...</b>\n\n"
+            f"<b>🔍 Scanned:</b> {counts['scanned']}\n"
+            f"<b>📦 Moved:</b> {counts['moved']}\n"
+            f"<b>⏱️ Time:</b> {time.time() - start_time:.1f}s"
+        )
+    
+    try:
+        counts = await db.rebalance_shards(progress=progress)
+    except Exception as e:
+        logger.error(f"Error during rebalance: {e}")
+        return await progress_edit(msg, f"❌ Rebalance failed: {e}")
+    
+    await progress_edit(
+        msg,
+        f"<b>✅ Rebalance completed!</b>\n\n"
+        f"<b>🔍 Scanned:</b> {counts['scanned']}\n"
+        f"<b>📦 Moved:</b> {counts['moved']}\n"
+        f"<b>⏸️ Skipped (owner offline):</b> {counts['skipped']}\n"
+        f"<b>❌ Errors:</b> {counts['errors']}\n"
+        f"<b>⏱️ Duration:</b> {time.time() - start_time:.1f}s"
     )
 
+@Client.on_message(filters.command('backfill') & filters.user(Config.AUTH_USERS))
+async def backfill_fields(bot, message):
+    """Add precomputed search fields to files indexed before they existed"""
+    
+    msg = await message.reply_text("🔄 Backfilling search fields...")
+    start_time = time.time()
+    last_update = start_time
+    
+    async def progress(counts):
+        nonlocal last_update
+        if time.time() - last_update < 10:
+            return
+        last_update = time.time()
+        progress_edit(
+            msg,
+            f"<b>🔄 Backfill in progress...</b>\n\n"
+            f"<b>🔍 Scanned:</b> {counts['scanned']}\n"
+            f"<b>✏️ Updated:</b> {counts['updated']}\n"
+            f"<b>⏱️ Time:</b> {time.time() - start_time:.1f}s"
+        )
+    
+    try:
+        counts = await db.backfill_search_fields(progress=progress)
+    except Exception as e:
+        logger.error(f"Error during backfill: {e}")
+        return await progress_edit(msg, f"❌ Backfill failed: {e}")
+    
+    await progress_edit(
+        msg,
+        f"<b>✅ Backfill completed!</b>\n\n"
+        f"<b>🔍 Scanned:</b> {counts['scanned']}\n"
+        f"<b>✏️ Updated:</b> {counts['updated']}\n"
+        f"<b>❌ Errors:</b> {counts['errors']}\n"
+        f"<b>⏱️ Duration:</b> {time.time() - start_time:.1f}s"
+    )
+
+@Client.on_message(filters.command('imdbrefresh') & filters.user(Config.AUTH_USERS))
+async def imdb_refresh(bot, message):
+    """Rebuild the offline IMDb index from the public dumps"""
+    
+    if not Config.IMDB_INDEX_PATH:
+        return await message.reply_text("❌ Set IMDB_INDEX_PATH to enable the offline IMDb index")
+    
+    msg = await message.reply_text("🔄 Downloading IMDb dumps and rebuilding index in the background...")
+    
+    async def run():
+        start_time = time.time()
+        try:
+            count = await refresh_title_index()
+            await msg.edit_text(
+                f"<b>✅ IMDb index rebuilt!</b>\n\n"
+                f"<b>🎬 Titles:</b> {count:,}\n"
+                f"<b>⏱️ Duration:</b> {time.time() - start_time:.1f}s",
+                parse_mode=enums.ParseMode.HTML
+            )
+        except Exception as e:
+            logger.error(f"Error rebuilding IMDb index: {e}")
+            await msg.edit_text(f"❌ IMDb index rebuild failed: {e}")
+    
+    asyncio.create_task(run())
+
 @Client.on_message(filters.command('stats') & filters.user(Config.AUTH_USERS))
 async def get_stats(bot, message):
     """Get database statistics"""
@@ -131,12 +254,34 @@ async def get_stats(bot, message):
     
     try:
         stats = await db.get_stats()
+        outbound_stats = outbound.stats()
+        
+        shard_lines = ""
+        for shard in stats['shards']:
+            files = f"{shard['files']:,}" if shard['files'] is not None else "-"
+            shard_lines += (
+                f"<b>🗄️ DB {shard['id']}:</b> {shard['state']} | "
+                f"{files} files | {shard['latency_ms']}ms | "
+                f"{shard['error_rate'] * 100:.0f}% errors\n"
+            )
         
         await msg.edit_text(
             f"<b>📊 Database Statistics</b>\n\n"
             f"<b>📁 Total Files:</b> {stats['total_files']:,}\n"
+            f"{shard_lines}"
             f"<b>🗄️ Active Databases:</b> {stats['active_databases']}/4\n"
             f"<b>💾 Cache Size:</b> {stats['cache_size']}\n"
+            f"<b>🎯 Cache Hit Rate:</b> {stats['search_cache']['hit_rate']:.0%} searches, "
+            f"{stats['detail_cache']['hit_rate']:.0%} files, "
+            f"{(stats['search_cache']['bytes'] + stats['detail_cache']['bytes']) / 1048576:.1f} MB\n"
+            f"<b>🧠 Memory Index:</b> {stats['search_index']['files']:,} files, {stats['search_index']['tokens']:,} tokens\n"
+            f"<b>🔤 Spell Index:</b> {stats['speller']['words']:,} words, {stats['speller']['bytes'] / 1048576:.1f} MB\n"
+            f"<b>🌸 Vocabulary Filter:</b> {stats['vocabulary']['items']:,} words, {stats['vocabulary']['false_positive_rate']:.2%} false positives\n"
+            f"<b>🚦 Admission:</b> {admission.admitted:,} admitted, {admission.rejected:,} limited, {admission.shed:,} shed\n"
+            f"<b>📤 Outbound:</b> {outbound_stats['sent']:,} sent, {outbound_stats['flood_waits']:,} flood waits, "
+            f"{outbound_stats['queued']} queued, {outbound_stats['dropped']:,} dropped, "
+            f"{outbound_stats['avg_wait_ms']:.0f} ms avg wait\n"
+            f"<b>🔗 Coalesced Searches:</b> {stats['search_coalesced']}/{stats['search_flights'] + stats['search_coalesced']}\n"
             f"<b>⚡ Status:</b> Online",
             parse_mode=enums.ParseMode.HTML
         )
@@ -144,6 +289,36 @@ async def get_stats(bot, message):
     except Exception as e:
         await msg.edit_text(f"❌ Error getting stats: {e}")
 
+def progress_edit(msg, text: str) -> asyncio.Future:
+    """Queue an edit of a status message; a newer edit replaces it while queued"""
+    return outbound.submit(
+        msg.chat.id,
+        lambda: msg.edit_text(text, parse_mode=enums.ParseMode.HTML),
+        OutboundScheduler.EDIT,
+        key=f"progress:{msg.chat.id}:{msg.id}"
+    )
+
+async def chat_history(bot, chat_id):
+    """Chat history, newest first, resuming where a FloodWait stopped it"""
+    offset_id = 0
+    while True:
+        try:
+            async for message_obj in bot.get_chat_history(chat_id, offset_id=offset_id):
+                offset_id = message_obj.id
+                yield message_obj
+            return
+        except FloodWait as e:
+            logger.warning(f"History fetch for {chat_id} paused {e.value}s by FloodWait")
+            await asyncio.sleep(e.value)
+
+def get_media(message_obj):
+    """Return the media object attached to a message, if any"""
+    for attr in ('document', 'video', 'audio', 'photo', 'animation', 'voice', 'video_note', 'sticker'):
+        media = getattr(message_obj, attr, None)
+        if media:
+            return media
+    return None
+
 def get_file_type(media):
     """Determine file type from media object"""
     if hasattr(media, 'mime_type') and media.mime_type:
@@ -0,0 +1,78 @@
+from pyrogram import Client, enums
+from pyrogram.file_id import FileType
+from pyrogram.types import (
+    InlineQuery, InlineQueryResultCachedDocument, InlineQueryResultCachedVideo, InlineQueryResultCachedAudio,
+    InlineQueryResultCachedPhoto, InlineQueryResultCachedAnimation, InlineQueryResultCachedVoice
+)
+from database.database import db
+from config import Config
+from utils import is_subscribed, file_kind
+from plugins.autofilter import get_size
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Inline result type for each kind of stored file id; stickers and video
+# notes cannot carry a caption and are left out
+RESULT_TYPES = {
+    FileType.DOCUMENT: InlineQueryResultCachedDocument,
+    FileType.VIDEO: InlineQueryResultCachedVideo,
+    FileType.AUDIO: InlineQueryResultCachedAudio,
+    FileType.PHOTO: InlineQueryResultCachedPhoto,
+    FileType.ANIMATION: InlineQueryResultCachedAnimation,
+    FileType.VOICE: InlineQueryResultCachedVoice
+}
+
+def inline_result(file, result_id: str):
+    """Cached inline result matching the file id's real media type, or None"""
+    kind = file_kind(file['file_id'])
+    result_type = RESULT_TYPES.get(kind)
+    if result_type is None:
+        return None
+    
+    size = get_size(file['file_size'])
+    options = {
+        'id': result_id,
+        'caption': f"<b>📁 {file['file_name']}</b>\n\n<b>📊 Size:</b> {size}",
+        'parse_mode': enums.ParseMode.HTML
+    }
+    # Audio shows its own performer and title
+    if kind != FileType.AUDIO:
+        options['title'] = file['file_name']
+    if kind in (FileType.DOCUMENT, FileType.VIDEO, FileType.PHOTO):
+        options['description'] = f"📊 {size}"
+    return result_type(file['file_id'], **options)
+
+@Client.on_inline_query()
+async def inline_search(bot, query: InlineQuery):
+    """Answer inline searches on every keystroke from the memory index"""
+    try:
+        if Config.AUTH_CHANNEL and not await is_subscribed(bot, query):
+            await query.answer(
+                results=[],
+                cache_time=0,
+                is_personal=True,
+                switch_pm_text="📢 Join our channel to search",
+                switch_pm_parameter="subscribe"
+            )
+            return
+        
+        offset = int(query.offset or 0)
+        files = db.get_completions(query.query, offset, Config.INLINE_RESULTS)
+        
+        results = []
+        for i, file in enumerate(files):
+            result = inline_result(file, str(offset + i))
+            if result is not None:
+                results.append(result)
+        
+        await query.answer(
+            results=results,
+            # Until the index is loaded the empty answer must not stick
+            cache_time=Config.INLINE_CACHE_TIME if db.search_index.ready else 0,
+            is_personal=bool(Config.AUTH_CHANNEL),
+            next_offset=str(offset + len(files)) if len(files) == Config.INLINE_RESULTS else ""
+        )
+    
+    except Exception as e:
+        logger.error(f"Inline query error: {e}")
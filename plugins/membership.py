@@ -0,0 +1,18 @@
+from pyrogram import Client, filters
+from pyrogram.types import ChatMemberUpdated
+from config import Config
+from utils import set_membership, is_member_status
+import logging
+
+logger = logging.getLogger(__name__)
+
+@Client.on_chat_member_updated(filters.chat(Config.AUTH_CHANNEL))
+async def auth_channel_member_updated(bot, update: ChatMemberUpdated):
+    """Keep the membership cache in step with joins and leaves"""
+    try:
+        member = update.new_chat_member or update.old_chat_member
+        if member is None or member.user is None:
+            return
+        set_membership(member.user.id, is_member_status(update.new_chat_member))
+    except Exception as e:
+        logger.error(f"Membership update error: {e}")
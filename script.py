@@ -18,10 +18,14 @@ Send me any movie/series name to search!</b>"""
 • Just send movie/series name
 • Bot will show available files
 • Click on file to get it in PM
+• Or type <code>@botusername name</code> in any chat for inline search
 
 <b>👨‍💼 Admin Commands:</b>
 • <code>/index [channel]</code> - Index files from channel
 • <code>/stats</code> - Get database statistics
+• <code>/rebalance</code> - Move files to their owning database
+• <code>/imdbrefresh</code> - Rebuild the offline IMDb index
+• <code>/backfill</code> - Add search fields to older files
 • <code>/broadcast</code> - Broadcast message to users
 
 <b>⚙️ Features:</b>
@@ -1,29 +1,86 @@
 import asyncio
+import contextvars
+import heapq
 import aiohttp
 import aiofiles
-from pyrogram import Client
-from pyrogram.errors import UserNotParticipant, ChatAdminRequired
+from pyrogram import Client, enums
+from pyrogram.errors import UserNotParticipant, ChatAdminRequired, FloodWait
+from pyrogram.file_id import FileId
 from config import Config
 import logging
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Set
 import re
+import secrets
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from cachetools import TTLCache
+from database.singleflight import SingleFlight
+from database.normalize import normalize_query
+from database.imdb_index import TitleIndex, build_index
 
 logger = logging.getLogger(__name__)
 
-async def is_subscribed(bot: Client, message) -> bool:
-    """Check if user is subscribed to auth channel"""
+# Auth channel membership: joins are cached longer than misses, and
+# chat member updates from the channel overwrite entries as they happen
+membership_cache = TTLCache(maxsize=Config.MEMBERSHIP_CACHE_SIZE, ttl=Config.MEMBERSHIP_CACHE_TIME)
+non_membership_cache = TTLCache(maxsize=Config.MEMBERSHIP_CACHE_SIZE, ttl=Config.MEMBERSHIP_NEGATIVE_CACHE_TIME)
+membership_flight = SingleFlight()
+
+def is_member_status(member) -> bool:
+    """Whether a ChatMember is currently in the chat"""
+    if member is None:
+        return False
+    if member.status == enums.ChatMemberStatus.RESTRICTED:
+        return bool(getattr(member, 'is_member', True))
+    return member.status not in (enums.ChatMemberStatus.LEFT, enums.ChatMemberStatus.BANNED)
+
+def set_membership(user_id: int, is_member: bool):
+    """Record a user's auth channel membership"""
+    if is_member:
+        non_membership_cache.pop(user_id, None)
+        membership_cache[user_id] = True
+    else:
+        membership_cache.pop(user_id, None)
+        non_membership_cache[user_id] = True
+
+async def _load_membership(bot: Client, user_id: int) -> Optional[bool]:
+    """Ask Telegram, caching the answer; None when the check failed"""
+    try:
+        member = await bot.get_chat_member(Config.AUTH_CHANNEL, user_id)
+        is_member = is_member_status(member)
+    except UserNotParticipant:
+        is_member = False
+    except Exception as e:
+        logger.error(f"Subscription check error: {e}")
+        return None
+    
+    set_membership(user_id, is_member)
+    return is_member
+
+async def is_subscribed(bot: Client, message, trust_negative: bool = True) -> bool:
+    """Check if user is subscribed to auth channel
+    
+    Pass trust_negative=False where a user who has just joined must not be
+    turned away by a cached miss, such as before sending a file.
+    """
     if not Config.AUTH_CHANNEL:
         return True
     
-    try:
-        user_id = message.from_user.id if hasattr(message, 'from_user') else message.user.id
-        await bot.get_chat_member(Config.AUTH_CHANNEL, user_id)
+    user = message.from_user if hasattr(message, 'from_user') else message.user
+    if user is None:
         return True
-    except UserNotParticipant:
+    
+    if user.id in membership_cache:
+        return True
+    if trust_negative and user.id in non_membership_cache:
         return False
-    except Exception as e:
-        logger.error(f"Subscription check error: {e}")
+    
+    is_member = await membership_flight.do(str(user.id), lambda: _load_membership(bot, user.id))
+    if is_member is None:
         return True  # Allow access if check fails
+    return is_member
 
 async def get_poster(query: str, bulk: bool = False, id: bool = False, file=None):
     """Get movie poster from TMDB API"""
@@ -38,6 +95,194 @@ async def get_poster(query: str, bulk: bool = False, id: bool = False, file=None
         logger.error(f"Poster fetch error: {e}")
         return None
 
+# IMDb lookups are blocking, so they run on a small dedicated pool
+imdb_executor = ThreadPoolExecutor(max_workers=Config.IMDB_WORKERS, thread_name_prefix="imdb")
+imdb_cache = TTLCache(maxsize=Config.IMDB_CACHE_SIZE, ttl=Config.IMDB_CACHE_TIME)
+imdb_negative_cache = TTLCache(maxsize=Config.IMDB_CACHE_SIZE, ttl=Config.IMDB_NEGATIVE_CACHE_TIME)
+imdb_flight = SingleFlight()
+_imdb_local = threading.local()
+
+# Offline title index, swapped in place when a refresh finishes
+title_index: Optional[TitleIndex] = None
+_title_index_refresh = None
+
+def load_title_index() -> bool:
+    """Open the offline IMDb index if one has been built"""
+    global title_index
+    
+    if not Config.IMDB_INDEX_PATH or not os.path.exists(Config.IMDB_INDEX_PATH):
+        return False
+    
+    try:
+        new_index = TitleIndex(Config.IMDB_INDEX_PATH)
+    except Exception as e:
+        logger.error(f"Failed to open IMDb index: {e}")
+        return False
+    
+    old_index, title_index = title_index, new_index
+    if old_index:
+        old_index.close()
+    logger.info(f"IMDb index loaded with {new_index.count} titles")
+    return True
+
+async def _download_dump(session: aiohttp.ClientSession, name: str, path: str):
+    """Stream one IMDb dataset file to disk"""
+    async with session.get(f"{Config.IMDB_DUMP_URL}/{name}") as response:
+        response.raise_for_status()
+        async with aiofiles.open(path, "wb") as f:
+            async for chunk in response.content.iter_chunked(1 << 20):
+                await f.write(chunk)
+
+async def refresh_title_index() -> int:
+    """Download the IMDb dumps and rebuild the offline index in the background
+    
+    The build runs in a separate process and replaces the index file
+    atomically; lookups keep using the old index until it is swapped.
+    Returns the number of indexed titles.
+    """
+    global _title_index_refresh
+    
+    if not Config.IMDB_INDEX_PATH:
+        raise RuntimeError("IMDB_INDEX_PATH is not set")
+    if _title_index_refresh and not _title_index_refresh.done():
+        # Join the refresh that is already running
+        return await asyncio.shield(_title_index_refresh)
+    
+    async def run():
+        directory = os.path.dirname(os.path.abspath(Config.IMDB_INDEX_PATH))
+        basics_path = os.path.join(directory, "title.basics.tsv.gz")
+        ratings_path = os.path.join(directory, "title.ratings.tsv.gz")
+        
+        async with aiohttp.ClientSession() as session:
+            await _download_dump(session, "title.basics.tsv.gz", basics_path)
+            await _download_dump(session, "title.ratings.tsv.gz", ratings_path)
+        
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            count = await loop.run_in_executor(
+                pool, build_index, basics_path, ratings_path, Config.IMDB_INDEX_PATH, Config.IMDB_MIN_VOTES
+            )
+        
+        load_title_index()
+        return count
+    
+    _title_index_refresh = asyncio.ensure_future(run())
+    return await asyncio.shield(_title_index_refresh)
+
+def format_title_info(title: Dict) -> str:
+    """Format an offline index entry like a live IMDb lookup"""
+    year = title['year'] or 'N/A'
+    genres = ', '.join(title['genres'][:3]) or 'N/A'
+    
+    return (f"<b>🎬 {title['title']} ({year})</b>\n"
+           f"<b>⭐ Rating:</b> {title['rating']}/10\n"
+           f"<b>🎭 Genre:</b> {genres}")
+
+def _fetch_movie_info(query: str) -> str:
+    """Blocking IMDb lookup, run on the IMDb thread pool"""
+    from imdb import IMDb
+    
+    # One client per worker thread
+    ia = getattr(_imdb_local, 'client', None)
+    if ia is None:
+        ia = _imdb_local.client = IMDb()
+    
+    movies = ia.search_movie(query)
+    if not movies:
+        return ""
+    
+    movie = movies[0]
+    ia.update(movie)
+    
+    title = movie.get('title', 'N/A')
+    year = movie.get('year', 'N/A')
+    rating = movie.get('rating', 'N/A')
+    genres = ', '.join(movie.get('genres', [])[:3])
+    plot = movie.get('plot outline', 'N/A')
+    
+    if len(plot) > 200:
+        plot = plot[:197] + "..."
+    
+    return (f"<b>🎬 {title} ({year})</b>\n"
+           f"<b>⭐ Rating:</b> {rating}/10\n"
+           f"<b>🎭 Genre:</b> {genres}\n"
+           f"<b>📝 Plot:</b> {plot}")
+
+async def _load_movie_info(key: str, query: str) -> str:
+    """Resolve movie info from Redis or IMDb and fill both cache tiers"""
+    from database.database import db
+    redis_key = f"imdb:{key}"
+    
+    if db.redis_client:
+        try:
+            cached = await db.redis_client.get(redis_key)
+            if cached is not None:
+                info = cached.decode()
+                if info:
+                    imdb_cache[key] = info
+                else:
+                    imdb_negative_cache[key] = True
+                return info
+        except Exception as e:
+            logger.error(f"Redis get error: {e}")
+    
+    loop = asyncio.get_running_loop()
+    try:
+        info = await loop.run_in_executor(imdb_executor, _fetch_movie_info, query)
+    except Exception as e:
+        # Lookup failures are not cached, only "no such title"
+        logger.error(f"IMDB error: {e}")
+        return ""
+    
+    if info:
+        imdb_cache[key] = info
+        ttl = Config.IMDB_CACHE_TIME
+    else:
+        imdb_negative_cache[key] = True
+        ttl = Config.IMDB_NEGATIVE_CACHE_TIME
+    
+    if db.redis_client:
+        try:
+            await db.redis_client.setex(redis_key, ttl, info)
+        except Exception as e:
+            logger.error(f"Redis set error: {e}")
+    
+    return info
+
+async def get_movie_info(query: str, timeout: float = Config.IMDB_TIMEOUT) -> str:
+    """Get movie information from IMDB within a latency budget
+    
+    Returns an empty string when nothing is known yet. A lookup that runs
+    past the budget keeps going in the background and fills the cache for
+    the next request.
+    """
+    key = normalize_query(query)
+    if not key:
+        return ""
+    
+    # The offline index answers in microseconds without any I/O
+    if title_index:
+        try:
+            title = title_index.lookup(key)
+            if title:
+                return format_title_info(title)
+        except Exception as e:
+            logger.error(f"IMDb index error: {e}")
+    
+    if key in imdb_cache:
+        return imdb_cache[key]
+    if key in imdb_negative_cache:
+        return ""
+    
+    lookup = imdb_flight.do(key, lambda: _load_movie_info(key, query))
+    try:
+        return await asyncio.wait_for(asyncio.shield(asyncio.ensure_future(lookup)), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.info(f"IMDB lookup over budget for: {query}")
+    except Exception as e:
+        logger.error(f"IMDB error: {e}")
+    return ""
+
 def extract_year(title: str) -> tuple:
     """Extract year from movie title"""
     year_pattern = r'\b(19|20)\d{2}\b'
@@ -78,32 +323,519 @@ async def get_search_results(query: str, file_type: str = None, max_results: int
     from database.database import db
     return await db.get_search_results(query, file_type, max_results)
 
+def file_kind(file_id: str):
+    """FileType a file id really refers to, or None if it does not decode
+
+    The stored file_type follows the mime type, so a video sent as a
+    document says video while Telegram only accepts it as a document.
+    """
+    try:
+        return FileId.decode(file_id).file_type
+    except Exception:
+        return None
+
 async def get_file_details(file_id: str) -> Optional[Dict]:
     """Get file details - wrapper for database function"""
     from database.database import db
     return await db.get_file_details(file_id)
 
+class ResultSession:
+    """Ordered search hits kept server-side for pagination callbacks"""
+    def __init__(self, token: str, query: str, hits: List[Dict], filters: Dict = None, base=None):
+        self.token = token
+        self.query = query
+        self.hits = hits
+        self.filters = filters or {}
+        self.base = base  # unfiltered session this one narrows
+        self.facets = None  # facet counts, fetched when the filter menu opens
+        self.pages = {}  # offset -> rendered keyboard
+        # Hits stop at MAX_RESULTS; later pages are fetched by keyset cursor
+        self.capped = len(hits) >= Config.MAX_RESULTS
+        self.cursors = {0: None}  # deep page number -> (score, _id) cursor
+
+class ResultSessionStore:
+    """Result sessions under short tokens, bounded by TTL and LRU"""
+    def __init__(self, maxsize: int, ttl: int):
+        self.sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+    
+    def create(self, query: str, files: List[Dict], filters: Dict = None, base: ResultSession = None) -> ResultSession:
+        """Store the ordered hits of a search and return its session"""
+        hits = [
+            {
+                'file_id': file_doc['file_id'],
+                'file_name': file_doc['file_name'],
+                'file_size': file_doc.get('file_size', 0),
+                'file_type': file_doc.get('file_type'),
+                'year': file_doc.get('year'),
+                'quality': file_doc.get('quality'),
+                'season': file_doc.get('season')
+            }
+            for file_doc in files
+        ]
+        
+        token = secrets.token_urlsafe(6)
+        while token in self.sessions:
+            token = secrets.token_urlsafe(6)
+        
+        session = ResultSession(token, query, hits, filters, base)
+        self.sessions[token] = session
+        return session
+    
+    def get(self, token: str) -> Optional[ResultSession]:
+        """Get a live session, refreshing its LRU position"""
+        return self.sessions.get(token)
+
+# Global store for pagination sessions
+result_sessions = ResultSessionStore(maxsize=Config.MAX_SESSIONS, ttl=Config.SESSION_TIME)
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+    
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def available(self, now: float) -> float:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+    
+    def wait_time(self, cost: float = 1.0) -> float:
+        """Seconds until cost tokens are available"""
+        missing = cost - self.available(time.monotonic())
+        return max(missing, 0.0) / self.rate
+
 class RateLimiter:
     """Simple rate limiter for API calls"""
     def __init__(self, max_calls: int, time_window: int):
-        self.max_calls = max_calls
-        self.time_window = time_window
-        self.calls = []
+        self.bucket = TokenBucket(max_calls / time_window, max_calls)
+        self.lock = asyncio.Lock()
     
     async def acquire(self):
         """Acquire rate limit token"""
-        import time
-        now = time.time()
+        async with self.lock:
+            delay = self.bucket.wait_time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.bucket.available(time.monotonic())
+            self.bucket.tokens -= 1
+
+# Global rate limiter for external API calls
+api_rate_limiter = RateLimiter(max_calls=10, time_window=60)  # 10 calls per minute
+
+# Takes cost from every bucket or from none: each bucket is refilled from
+# its last update, checked against cost plus its reserve, then all are
+# charged. Returns ADMITTED, REJECTED, or SHED when only a reserve was short
+ADMISSION_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local levels = {}
+local outcome = 1
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local burst = tonumber(ARGV[i * 3])
+    local reserve = tonumber(ARGV[i * 3 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    if tokens < cost then
+        return 0
+    end
+    if tokens < cost + reserve then
+        outcome = -1
+    end
+    levels[i] = tokens
+end
+if outcome ~= 1 then
+    return outcome
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local burst = tonumber(ARGV[i * 3])
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - cost), 'updated', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return 1
+"""
+
+class AdmissionController:
+    """Per-user, per-chat and global token buckets in front of searches
+    
+    Low-priority requests must leave a reserve in the global bucket, so
+    when the bot is saturated they are shed first and the remaining
+    capacity goes to high-priority ones. Buckets live in memory, or in
+    Redis when redis_client is set, so several bot processes share them.
+    """
+    HIGH = 0
+    LOW = 1
+    
+    ADMITTED = 1
+    REJECTED = 0
+    SHED = -1
+    
+    def __init__(self, user_rate: float, user_burst: float, chat_rate: float, chat_burst: float,
+                 global_rate: float, global_burst: float, shed_reserve: float):
+        self.limits = {
+            'user': (user_rate, user_burst),
+            'chat': (chat_rate, chat_burst),
+            'global': (global_rate, global_burst)
+        }
+        self.shed_reserve = shed_reserve
+        # Idle buckets are full again after burst / rate seconds, so dropping them loses nothing
+        refill_time = max(burst / rate for rate, burst in self.limits.values())
+        self.buckets = TTLCache(maxsize=100000, ttl=refill_time)
+        self.redis_client = None
+        self._script = None
+        self.admitted = 0
+        self.rejected = 0
+        self.shed = 0
+    
+    def _bucket_specs(self, user_id: Optional[int], chat_id: Optional[int], priority: int) -> List[tuple]:
+        rate, burst = self.limits['global']
+        reserve = burst * self.shed_reserve if priority == self.LOW else 0.0
+        specs = [('admit:global', rate, burst, reserve)]
+        # A private chat is its user, already covered by the user budget
+        if chat_id is not None and chat_id < 0:
+            specs.append((f"admit:chat:{chat_id}", *self.limits['chat'], 0.0))
+        if user_id is not None:
+            specs.append((f"admit:user:{user_id}", *self.limits['user'], 0.0))
+        return specs
+    
+    def _admit_local(self, specs: List[tuple], cost: float) -> int:
+        now = time.monotonic()
+        buckets = []
+        outcome = self.ADMITTED
+        for key, rate, burst, reserve in specs:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(rate, burst)
+            tokens = bucket.available(now)
+            if tokens < cost:
+                return self.REJECTED
+            if tokens < cost + reserve:
+                outcome = self.SHED
+            buckets.append(bucket)
+        if outcome != self.ADMITTED:
+            return outcome
+        for (key, *_), bucket in zip(specs, buckets):
+            bucket.tokens -= cost
+            self.buckets[key] = bucket  # busy buckets must not expire
+        return self.ADMITTED
+    
+    async def _admit_shared(self, specs: List[tuple], cost: float) -> int:
+        if self._script is None:
+            self._script = self.redis_client.register_script(ADMISSION_SCRIPT)
+        args = [cost]
+        for _, rate, burst, reserve in specs:
+            args += [rate, burst, reserve]
+        return int(await self._script(keys=[spec[0] for spec in specs], args=args))
+    
+    async def admit(self, user_id: Optional[int], chat_id: Optional[int], priority: int = LOW,
+                    cost: float = 1.0) -> bool:
+        """Take cost from every bucket, or return False and take nothing"""
+        specs = self._bucket_specs(user_id, chat_id, priority)
+        
+        outcome = None
+        if self.redis_client:
+            try:
+                outcome = await self._admit_shared(specs, cost)
+            except Exception as e:
+                # Fall back to this process's own budget while Redis is away
+                logger.error(f"Shared admission error: {e}")
+        if outcome is None:
+            outcome = self._admit_local(specs, cost)
+        
+        if outcome == self.ADMITTED:
+            self.admitted += 1
+        elif outcome == self.SHED:
+            self.shed += 1
+        else:
+            self.rejected += 1
+        return outcome == self.ADMITTED
+    
+    def stats(self) -> Dict:
+        return {'admitted': self.admitted, 'rejected': self.rejected, 'shed': self.shed}
+
+# Admission control for group searches
+admission = AdmissionController(
+    user_rate=Config.ADMISSION_USER_RATE,
+    user_burst=Config.ADMISSION_USER_BURST,
+    chat_rate=Config.ADMISSION_CHAT_RATE,
+    chat_burst=Config.ADMISSION_CHAT_BURST,
+    global_rate=Config.ADMISSION_GLOBAL_RATE,
+    global_burst=Config.ADMISSION_GLOBAL_BURST,
+    shed_reserve=Config.ADMISSION_SHED_RESERVE
+)
+
+# Sleep threshold for API calls made by the outbound queue, None elsewhere
+flood_sleep_threshold: contextvars.ContextVar = contextvars.ContextVar('flood_sleep_threshold', default=None)
+
+class OutboundJob:
+    """One queued Telegram call and the future its caller waits on"""
+    __slots__ = ('priority', 'seq', 'chat_id', 'call', 'key', 'future', 'attempts', 'queued_at')
+    
+    def __init__(self, priority: int, seq: int, chat_id: int, call, key: Optional[str], future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.call = call
+        self.key = key
+        self.future = future
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+    
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class OutboundScheduler:
+    """Paced queues for messages the bot sends or edits
+    
+    Each chat has its own priority queue and token bucket, and a global
+    bucket paces them all. Chats whose next call may go now wait in one
+    heap ordered by that call's priority; chats out of budget wait in a
+    timer heap, so a busy group is never rescanned on every dispatch. A
+    FloodWait pauses only the chat it came from, and the call is queued
+    again. Calls given a key replace a still-queued call with the same key,
+    so a burst of progress edits becomes the latest one. A chat keeps at
+    most backlog queued replies; older ones answer searches nobody is
+    waiting for anymore and are dropped.
+    """
+    DELIVERY = 0  # files users asked for
+    REPLY = 1     # search results and page flips
+    EDIT = 2      # progress and status edits
+    
+    def __init__(self, global_rate: float, private_rate: float, group_rate: float, burst: float,
+                 concurrency: int, retries: int, backlog: int, sleep_threshold: float):
+        self.global_bucket = TokenBucket(global_rate, burst * 4)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.retries = retries
+        self.concurrency = concurrency
+        self.backlog = backlog
+        self.sleep_threshold = sleep_threshold
+        self.chat_buckets = TTLCache(maxsize=100000, ttl=burst / min(private_rate, group_rate))
+        self.blocked: Dict[int, float] = {}  # chat id -> monotonic time its FloodWait ends
+        
+        self.chats: Dict[int, List[OutboundJob]] = {}  # chat id -> heap of its queued jobs
+        self.ready: List[tuple] = []   # (priority, seq, chat id) of a chat's next job; stale entries skipped
+        self.timers: List[tuple] = []  # (monotonic time, chat id) when an out of budget chat may go again
+        self.waiting: Set[int] = set()  # chats in timers
+        self.keyed: Dict[str, OutboundJob] = {}
+        self.queued = 0
+        self.seq = 0
+        self.task = None
+        self.wakeup = None
+        self.slots = None
         
-        # Remove old calls outside time window
-        self.calls = [call_time for call_time in self.calls if now - call_time < self.time_window]
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.dispatched = 0
+        self.wait_total = 0.0  # seconds calls spent queued
+        self.wait_max = 0.0
+    
+    def submit(self, chat_id: int, call, priority: int = REPLY, key: str = None) -> asyncio.Future:
+        """Queue call, a function returning the API coroutine, for chat_id"""
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.slots = asyncio.Semaphore(self.concurrency)
+            self.task = asyncio.create_task(self._dispatch())
+        
+        queued = self.keyed.get(key) if key else None
+        if queued is not None:
+            queued.call = call
+            self.coalesced += 1
+            return queued.future
+        
+        future = asyncio.get_running_loop().create_future()
+        # Mark failures retrieved, so fire-and-forget submissions do not warn
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        
+        self.seq += 1
+        job = OutboundJob(priority, self.seq, chat_id, call, key, future)
+        if key:
+            self.keyed[key] = job
+        self._enqueue(job)
+        if priority == self.REPLY and self.backlog > 0:
+            self._drop_stale_replies(chat_id)
+        return future
+    
+    async def send(self, chat_id: int, call, priority: int = REPLY, key: str = None):
+        """Queue call and wait for its result"""
+        return await self.submit(chat_id, call, priority, key)
+    
+    def _enqueue(self, job: OutboundJob):
+        jobs = self.chats.get(job.chat_id)
+        if jobs is None:
+            self.chats[job.chat_id] = [job]
+            self._schedule(job.chat_id, time.monotonic())
+        else:
+            heapq.heappush(jobs, job)
+            if job.chat_id not in self.waiting and jobs[0] is job:
+                heapq.heappush(self.ready, (job.priority, job.seq, job.chat_id))
+        self.queued += 1
+        self.wakeup.set()
+    
+    def _drop_stale_replies(self, chat_id: int):
+        """Cancel the oldest queued replies of a chat beyond its backlog"""
+        jobs = self.chats[chat_id]
+        replies = sorted(job for job in jobs if job.priority == self.REPLY)
+        excess = len(replies) - self.backlog
+        if excess <= 0:
+            return
         
-        if len(self.calls) >= self.max_calls:
-            sleep_time = self.time_window - (now - self.calls[0])
-            if sleep_time > 0:
-                await asyncio.sleep(sleep_time)
+        for job in replies[:excess]:
+            jobs.remove(job)
+            if job.key and self.keyed.get(job.key) is job:
+                del self.keyed[job.key]
+            job.future.cancel()
+            self.queued -= 1
+            self.dropped += 1
+        heapq.heapify(jobs)
+        if chat_id not in self.waiting:
+            heapq.heappush(self.ready, (jobs[0].priority, jobs[0].seq, chat_id))
+    
+    def _schedule(self, chat_id: int, now: float):
+        """File a chat with queued jobs as ready, or as waiting for budget"""
+        wait = self._chat_wait(chat_id, now)
+        if wait > 0:
+            self.waiting.add(chat_id)
+            heapq.heappush(self.timers, (now + wait, chat_id))
+        else:
+            head = self.chats[chat_id][0]
+            heapq.heappush(self.ready, (head.priority, head.seq, chat_id))
+    
+    def _chat_wait(self, chat_id: int, now: float) -> float:
+        """Seconds until chat_id may receive another call"""
+        blocked_until = self.blocked.get(chat_id)
+        if blocked_until is not None:
+            if blocked_until > now:
+                return blocked_until - now
+            del self.blocked[chat_id]
         
-        self.calls.append(now)
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            rate = self.private_rate if chat_id > 0 else self.group_rate
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, self.burst)
+        return bucket.wait_time()
+    
+    async def _sleep(self, delay: Optional[float]):
+        """Sleep up to delay seconds, or until woken for new submissions"""
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def _dispatch(self):
+        while True:
+            # Chats whose budget is back become ready again
+            now = time.monotonic()
+            while self.timers and self.timers[0][0] <= now:
+                _, chat_id = heapq.heappop(self.timers)
+                self.waiting.discard(chat_id)
+                if chat_id in self.chats:
+                    self._schedule(chat_id, now)
+            
+            if not self.ready:
+                await self._sleep(self.timers[0][0] - now if self.timers else None)
+                continue
+            
+            delay = self.global_bucket.wait_time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            
+            # Highest priority job among chats that have budget
+            priority, seq, chat_id = heapq.heappop(self.ready)
+            jobs = self.chats.get(chat_id)
+            if not jobs or chat_id in self.waiting or (jobs[0].priority, jobs[0].seq) != (priority, seq):
+                continue
+            if self._chat_wait(chat_id, now) > 0:
+                self._schedule(chat_id, now)
+                continue
+            
+            job = heapq.heappop(jobs)
+            self.queued -= 1
+            if job.key and self.keyed.get(job.key) is job:
+                del self.keyed[job.key]
+            waited = now - job.queued_at
+            self.dispatched += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.global_bucket.tokens -= 1
+            bucket = self.chat_buckets.get(job.chat_id)
+            if bucket is not None:
+                bucket.tokens -= 1
+                self.chat_buckets[job.chat_id] = bucket  # busy buckets must not expire
+            
+            if jobs:
+                self._schedule(chat_id, now)
+            else:
+                del self.chats[chat_id]
+            
+            await self.slots.acquire()
+            asyncio.create_task(self._run(job))
+    
+    async def _run(self, job: OutboundJob):
+        # Runs in its own task, so only this call's invokes see the threshold
+        flood_sleep_threshold.set(self.sleep_threshold)
+        try:
+            result = await job.call()
+        except FloodWait as e:
+            self.flood_waits += 1
+            self.blocked[job.chat_id] = time.monotonic() + e.value
+            if job.attempts < self.retries:
+                job.attempts += 1
+                self._enqueue(job)
+            else:
+                self.failed += 1
+                logger.error(f"Outbound call to {job.chat_id} failed after {job.attempts} FloodWait retries: {e}")
+                if not job.future.done():
+                    job.future.set_exception(e)
+        except Exception as e:
+            self.failed += 1
+            # Most calls are fire-and-forget, so nobody else sees the error
+            logger.error(f"Outbound call to {job.chat_id} failed: {e}")
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.slots.release()
+    
+    def stats(self) -> Dict:
+        return {
+            'queued': self.queued,
+            'chats': len(self.chats),
+            'sent': self.sent,
+            'failed': self.failed,
+            'flood_waits': self.flood_waits,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'avg_wait_ms': round(self.wait_total / self.dispatched * 1000, 1) if self.dispatched else 0.0,
+            'max_wait_ms': round(self.wait_max * 1000, 1),
+            'blocked_chats': sum(1 for until in self.blocked.values() if until > time.monotonic())
+        }
 
-# Global rate limiter for external API calls
-api_rate_limiter = RateLimiter(max_calls=10, time_window=60)  # 10 calls per minute
\ No newline at end of file
+# Every message the bot sends or edits goes through here
+outbound = OutboundScheduler(
+    global_rate=Config.SEND_GLOBAL_RATE,
+    private_rate=Config.SEND_PRIVATE_RATE,
+    group_rate=Config.SEND_GROUP_RATE,
+    burst=Config.SEND_BURST,
+    concurrency=Config.SEND_CONCURRENCY,
+    retries=Config.SEND_RETRIES,
+    backlog=Config.SEND_CHAT_BACKLOG,
+    sleep_threshold=Config.FLOOD_SLEEP_THRESHOLD
+)